@@ -0,0 +1,71 @@
+"""
+Flask-Admin lists on big tables.
+
+Seeds --users users with --favorites-per-user favorites each and times the
+/admin/favorite/ and /admin/user/ lists through the Flask test client: the first
+page, a deep page reached with the ?after= cursor of the pager and the same page
+by number (OFFSET), a filtered list and a sorted one, with the number of SQL
+statements each one runs.
+
+    $ python benchmarks/admin.py --users 40000 --favorites-per-user 25
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ["ENABLE_ADMIN"] = "true"
+
+from common import DEFAULT_DATABASE, load_app, save_results, seed  # noqa: E402
+
+
+def pages(cfg, favorites, page_size):
+    deep = favorites // page_size // 2
+    return {
+        "favorites_first_page": "/admin/favorite/",
+        "favorites_deep_cursor": f"/admin/favorite/?page={deep}&after={favorites - deep * page_size + 1}",
+        "favorites_deep_offset": f"/admin/favorite/?page={deep}",
+        "favorites_of_user": f"/admin/favorite/?flt0_0={cfg.users // 2}",
+        "favorites_sorted_by_id": "/admin/favorite/?sort=0&desc=1",
+        "users_first_page": "/admin/user/",
+        "users_deep_cursor": f"/admin/user/?page={cfg.users // page_size // 2}&after={cfg.users // 2 + 1}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--favorites-per-user", type=int, default=25)
+    parser.add_argument("--requests", type=int, default=20, help="requests per page")
+    parser.add_argument("--output")
+    cfg = parser.parse_args()
+
+    app = load_app(cfg.database)
+    seed(app, 1000, 1000, 1000, users=cfg.users, favorites_per_user=cfg.favorites_per_user)
+    from sqlalchemy import event
+    from models import db
+    from admin import LargeTableModelView
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    client = app.test_client()
+    client.get("/admin/favorite/")
+
+    results = {}
+    for name, url in pages(cfg, cfg.users * cfg.favorites_per_user, LargeTableModelView.page_size).items():
+        latencies = []
+        for _ in range(cfg.requests):
+            statements.clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, (url, response.status_code)
+        results[name] = {"url": url, "median_ms": round(statistics.median(latencies) * 1000, 2),
+                         "statements": len(statements)}
+        print(f"{name:<26}{results[name]['median_ms']:>10.2f} ms{len(statements):>4} statements   {url}")
+    print("saved", save_results("admin", vars(cfg), results, cfg.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Load test of every route in src/app.py.
+
+Seeds a SQLite database with the requested volumes, then runs each scenario
+either in-process through the Flask test client (`--mode client`, measures the
+app itself) or over HTTP against a multi-worker gunicorn serving src/wsgi.py
+with the settings of gunicorn.conf.py (`--mode gunicorn`). Throughput and
+p50/p95/p99 latencies are printed and saved to benchmarks/results/ as JSON so
+runs can be compared.
+
+    $ python benchmarks/api.py --mode client --planets 20000 --requests 500
+    $ python benchmarks/api.py --mode gunicorn --workers 4 --concurrency 16
+    $ python benchmarks/compare.py benchmarks/results/api-A.json benchmarks/results/api-B.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import DEFAULT_DATABASE, ROOT, SRC, auth_headers, load_app, print_table, save_results, seed, summarize
+
+GUNICORN_CONFIG = os.path.join(ROOT, "gunicorn.conf.py")
+# warmup requests use their own indexes so they do not create the users or favorites the run uses
+WARMUP_OFFSET = 10 ** 6
+# scenario -> check of the body of an accepted response, a falsy result counts as an error
+BODY_CHECKS = {
+    # every query of the scenario matches the seeded data, no results means an empty index
+    "search": lambda body: json.loads(body)["results"],
+}
+
+
+def scenarios(cfg):
+    """
+    name -> (method, path(i, rng), body(i, rng) or None, accepted statuses, share of --requests[, user(i)]),
+    the requests of the scenarios with user(i) carry the bearer token of that user
+    """
+    run = f"{os.getpid()}-{int(time.time())}"
+    users, planets, characters, vehicles = cfg.users, cfg.planets, cfg.characters, cfg.vehicles
+
+    def user(rng):
+        return rng.randint(1, users)
+
+    def page(rng, size):
+        return f"limit=100&after={rng.randint(0, max(0, size - 100))}"
+
+    # add and delete use the same (user, planet) pairs so the table ends as it started
+    def favorite_pair(i):
+        return i % users + 1, planets - (i // users) % planets
+
+    def owner(i):
+        return i % users + 1
+
+    return {
+        "sitemap": ("GET", lambda i, rng: "/", None, (200,), 0.2),
+        "list_users": ("GET", lambda i, rng: "/user", None, (200,), 0.2),
+        "get_user": ("GET", lambda i, rng: f"/user/{user(rng)}", None, (200,), 1),
+        "create_user": ("POST", lambda i, rng: "/user",
+                        lambda i, rng: {"email": f"bench-{run}-{i}@example.com", "password": "benchmark"}, (201,), 0.5),
+        "create_user_duplicate": ("POST", lambda i, rng: "/user",
+                                  lambda i, rng: {"email": f"user{user(rng)}@example.com", "password": "benchmark"}, (409,), 0.2),
+        "login": ("POST", lambda i, rng: "/login",
+                  lambda i, rng: {"email": f"user{user(rng)}@example.com", "password": "benchmark"}, (200,), 0.5),
+        "login_wrong_password": ("POST", lambda i, rng: "/login",
+                                 lambda i, rng: {"email": f"user{user(rng)}@example.com", "password": "wrong"}, (401,), 0.2),
+        "invalid_request": ("GET", lambda i, rng: "/planets?limit=invalid", None, (400,), 0.2),
+        "favorites": ("GET", lambda i, rng: "/me/favorites", None, (200,), 1, owner),
+        "favorites_expand": ("GET", lambda i, rng: "/me/favorites?expand=true", None, (200,), 1, owner),
+        "favorites_summary": ("GET", lambda i, rng: "/me/favorites/summary", None, (200,), 1, owner),
+        "favorites_by_user_id": ("GET", lambda i, rng: f"/user/{owner(i)}/favorites", None, (200,), 0.5, owner),
+        "favorites_top": ("GET", lambda i, rng: "/favorites/top?limit=10", None, (200,), 0.5),
+        "favorites_batch": ("POST", lambda i, rng: "/me/favorites/batch",
+                            lambda i, rng: {"operations": [
+                                {"op": "add", "type": "vehicle", "id": vehicles - i % vehicles},
+                                {"op": "remove", "type": "vehicle", "id": vehicles - i % vehicles}]}, (200, 409), 0.5, owner),
+        "favorites_unauthenticated": ("GET", lambda i, rng: "/me/favorites", None, (401,), 0.2),
+        "list_characters": ("GET", lambda i, rng: f"/characters?{page(rng, characters)}", None, (200,), 1),
+        "list_planets": ("GET", lambda i, rng: f"/planets?{page(rng, planets)}", None, (200,), 1),
+        "list_vehicles": ("GET", lambda i, rng: f"/vehicles?{page(rng, vehicles)}", None, (200,), 1),
+        "list_planets_fields": ("GET", lambda i, rng: f"/planets?{page(rng, planets)}&fields=name", None, (200,), 0.5),
+        "list_vehicles_filtered": ("GET", lambda i, rng: "/vehicles?manufacturer=Kuat%20Drive%20Yards"
+                                   f"&cost_in_credits__gte={rng.randint(0, 10 ** 6)}&sort=-name&limit=50", None, (200,), 0.5),
+        "list_planets_name_prefix": ("GET", lambda i, rng: f"/planets?name_prefix=planet%20{rng.randint(1, 99)}&limit=50",
+                                     None, (200,), 0.5),
+        "search": ("GET", lambda i, rng: "/search?q=" + rng.choice([
+            f"{rng.choice(['planet', 'character', 'vehicle'])}%20{rng.randint(1, 99)}",
+            rng.choice(["desert%20planet", "frozen%20planet", "kuat%20vehicle", "female%20character"])]),
+                   None, (200,), 0.5),
+        "get_character": ("GET", lambda i, rng: f"/characters/{rng.randint(1, characters)}", None, (200,), 1),
+        "get_planet": ("GET", lambda i, rng: f"/planets/{rng.randint(1, planets)}", None, (200,), 1),
+        "get_vehicle": ("GET", lambda i, rng: f"/vehicles/{rng.randint(1, vehicles)}", None, (200,), 1),
+        "multi_get_planets": ("GET", lambda i, rng: "/planets?ids=" + ",".join(
+            str(rng.randint(1, planets)) for _ in range(50)), None, (200,), 0.5),
+        "batch_mixed": ("GET", lambda i, rng: "/batch?refs=" + ",".join(
+            f"{kind}:{rng.randint(1, size)}" for kind, size in [("planet", planets), ("character", characters),
+                                                                ("vehicle", vehicles)] for _ in range(20)), None, (200,), 0.5),
+        "export_planets": ("GET", lambda i, rng: "/export/planets", None, (200,), 0.02),
+        "add_favorite_planet": ("POST", lambda i, rng: "/me/favorites/planets/%d" % favorite_pair(i)[1], None,
+                                (200, 201), 0.5, owner),
+        "delete_favorite_planet": ("DELETE", lambda i, rng: "/me/favorites/planets/%d" % favorite_pair(i)[1], None,
+                                   (200, 404), 0.5, owner),
+        "cache_stats": ("GET", lambda i, rng: "/cache/stats", None, (200,), 0.2),
+    }
+
+
+def run_client(cfg, app, selected):
+    client = app.test_client()
+    results = {}
+    for name, (method, path, body, accepted, share, *user) in selected.items():
+        check = BODY_CHECKS.get(name)
+        rng = random.Random(name)
+        count = max(1, int(cfg.requests * share))
+        for i in range(WARMUP_OFFSET, WARMUP_OFFSET + min(cfg.warmup, count)):
+            client.open(path(i, rng), method=method, json=body(i, rng) if body else None,
+                        headers=auth_headers(user[0](i)) if user else None)
+        rng = random.Random(name)
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for i in range(count):
+            headers = auth_headers(user[0](i)) if user else None
+            t0 = time.perf_counter()
+            response = client.open(path(i, rng), method=method, json=body(i, rng) if body else None, headers=headers)
+            data = response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            errors += response.status_code not in accepted or bool(check and not check(data))
+        results[name] = summarize(latencies, time.perf_counter() - start, errors)
+    return results
+
+
+def start_gunicorn(cfg, env=None, config=GUNICORN_CONFIG):
+    env = dict(os.environ, DATABASE_URL=cfg.database, **(env or {}))
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "--config", config, "--chdir", SRC,
+               "--bind", f"127.0.0.1:{cfg.port}", "--workers", str(cfg.workers), "--log-level", "warning"] + cfg.gunicorn_args
+    process = subprocess.Popen(command, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", cfg.port, timeout=1)
+            conn.request("GET", "/cache/stats")
+            conn.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def run_http(cfg, selected):
+    local = threading.local()
+
+    def call(method, path, body, auth):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection("127.0.0.1", cfg.port, timeout=60)
+        payload = json.dumps(body) if body is not None else None
+        headers = dict(auth or {})
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        t0 = time.perf_counter()
+        try:
+            local.conn.request(method, path, body=payload, headers=headers)
+            response = local.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            data, status = b"", 0
+        return time.perf_counter() - t0, status, data
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=cfg.concurrency) as pool:
+        for name, (method, path, body, accepted, share, *user) in selected.items():
+            check = BODY_CHECKS.get(name)
+            rng = random.Random(name)
+            count = max(1, int(cfg.requests * share))
+            warmup = [(method, path(i, rng), body(i, rng) if body else None, auth_headers(user[0](i)) if user else None)
+                      for i in range(WARMUP_OFFSET, WARMUP_OFFSET + min(cfg.warmup, count))]
+            list(pool.map(lambda c: call(*c), warmup))
+            calls = [(method, path(i, rng), body(i, rng) if body else None, auth_headers(user[0](i)) if user else None)
+                     for i in range(count)]
+            start = time.perf_counter()
+            outcomes = list(pool.map(lambda c: call(*c), calls))
+            elapsed = time.perf_counter() - start
+            errors = sum(o[1] not in accepted or bool(check and not check(o[2])) for o in outcomes)
+            results[name] = summarize([o[0] for o in outcomes], elapsed, errors)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["client", "gunicorn"], default="client")
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--planets", type=int, default=5000)
+    parser.add_argument("--characters", type=int, default=5000)
+    parser.add_argument("--vehicles", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--favorites-per-user", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario, scaled by its share")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads in gunicorn mode")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--gunicorn-args", nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments for gunicorn, must be last")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data already in --database")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/api-<mode>-<time>.json")
+    cfg = parser.parse_args()
+
+    app = load_app(cfg.database)
+    if not cfg.no_seed:
+        start = time.perf_counter()
+        seed(app, cfg.planets, cfg.characters, cfg.vehicles, cfg.users, cfg.favorites_per_user)
+        print(f"seeded {cfg.database} in {time.perf_counter() - start:.1f}s")
+
+    selected = {name: s for name, s in scenarios(cfg).items() if not cfg.only or name in cfg.only}
+    if cfg.mode == "client":
+        results = run_client(cfg, app, selected)
+    else:
+        process = start_gunicorn(cfg)
+        try:
+            results = run_http(cfg, selected)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+
+    print_table(results)
+    config = {k: v for k, v in vars(cfg).items() if k != "output"}
+    print("saved", save_results(f"api-{cfg.mode}", config, results, cfg.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Helpers shared by the benchmark scripts: seeding, timing statistics and result files."""
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SRC = os.path.join(ROOT, "src")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_DATABASE = "sqlite:////tmp/benchmark.db"
+
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+CLIMATES = ["arid", "temperate", "frozen", "murky", "tropical"]
+TERRAINS = ["desert", "grasslands", "mountains", "tundra", "jungle", "ocean"]
+GENDERS = ["male", "female", "n/a", "hermaphrodite"]
+MANUFACTURERS = ["Incom Corporation", "Kuat Drive Yards", "Sienar Fleet Systems", "Corellian Engineering"]
+
+
+def load_app(database_url=DEFAULT_DATABASE):
+    """Builds the Flask app pointed at `database_url` (DATABASE_URL is read at import time)"""
+    os.environ["DATABASE_URL"] = database_url
+    # the load tests send thousands of requests from one client, also read by the gunicorn workers
+    os.environ.setdefault("RATELIMIT_ENABLED", "false")
+    from app import create_app
+    return create_app()
+
+
+_auth_headers = {}
+
+
+def auth_headers(user_id):
+    """Authorization header with a token of the user, valid for the gunicorn workers too (same AUTH_SECRET_KEY)"""
+    if user_id not in _auth_headers:
+        from auth import issue_token
+        _auth_headers[user_id] = {"Authorization": f"Bearer {issue_token(user_id)[0]}"}
+    return _auth_headers[user_id]
+
+
+def seed(app, planets=1000, characters=1000, vehicles=1000, users=100, favorites_per_user=10, chunk=10000):
+    """Drops and recreates every table and fills them with deterministic data"""
+    from models import db, User, Planet, Character, Vehicle, Favorite
+    rng = random.Random(1977)
+
+    def insert_all(model, rows):
+        rows = iter(rows)
+        while True:
+            batch = [row for _, row in zip(range(chunk), rows)]
+            if not batch:
+                break
+            with db.engine.begin() as conn:
+                conn.execute(model.__table__.insert(), batch)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # every user logs in with "benchmark", one hash is enough for all of them
+        from credentials import hash_password
+        password = hash_password("benchmark")
+        insert_all(User, ({"id": i, "email": f"user{i}@example.com", "password": password, "is_active": True}
+                          for i in range(1, users + 1)))
+        insert_all(Planet, ({"id": i, "name": f"Planet {i}", "rotation_period": rng.randint(10, 40),
+                             "orbital_period": rng.randint(100, 5000), "diameter": rng.randint(1000, 200000),
+                             "climate": rng.choice(CLIMATES), "gravity": "1 standard", "terrain": rng.choice(TERRAINS)}
+                            for i in range(1, planets + 1)))
+        insert_all(Character, ({"id": i, "name": f"Character {i}", "height": rng.randint(60, 260),
+                                "mass": round(rng.uniform(20, 200), 1), "hair_color": "brown", "skin_color": "fair",
+                                "eye_color": "blue", "birth_year": f"{rng.randint(1, 900)}BBY", "gender": rng.choice(GENDERS)}
+                               for i in range(1, characters + 1)))
+        insert_all(Vehicle, ({"id": i, "name": f"Vehicle {i}", "model": f"Model {i % 97}",
+                              "manufacturer": rng.choice(MANUFACTURERS), "cost_in_credits": float(rng.randint(1000, 10 ** 7)),
+                              "passengers": rng.randint(0, 500), "cargo_capacity": rng.randint(0, 10 ** 6)}
+                             for i in range(1, vehicles + 1)))
+
+        def favorites():
+            for user_id in range(1, users + 1):
+                picked = set()
+                while len(picked) < favorites_per_user:
+                    kind, size = rng.choice((("planet_id", planets), ("character_id", characters), ("vehicle_id", vehicles)))
+                    picked.add((kind, rng.randint(1, size)))
+                for kind, ref_id in picked:
+                    row = {"user_id": user_id, "planet_id": None, "character_id": None, "vehicle_id": None}
+                    row[kind] = ref_id
+                    yield row
+        insert_all(Favorite, favorites())
+        # the Core inserts above skip the counters kept by the session
+        # and the search index kept by the mapper events
+        from counters import recount_favorites
+        from search import rebuild_index, SEARCHABLE
+        with db.engine.begin() as conn:
+            recount_favorites(conn)
+            for type_name in SEARCHABLE:
+                rebuild_index(conn, type_name)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (milliseconds) of a list of latencies in seconds"""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "rps": round(len(values) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": commit}
+
+
+def save_results(name, config, results, output=None):
+    """Writes a result file that can be compared between runs and returns its path"""
+    path = output or os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"benchmark": name, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "environment": environment(), "config": config, "results": results}, f, indent=2)
+    return path
+
+
+def print_table(results):
+    print(f"{'scenario':<34}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, row in results.items():
+        print(f"{name:<34}{row['rps'] or 0:>10.1f}{row['p50_ms'] or 0:>10.3f}{row['p95_ms'] or 0:>10.3f}"
+              f"{row['p99_ms'] or 0:>10.3f}{row['errors']:>8}")
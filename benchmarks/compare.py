@@ -0,0 +1,44 @@
+"""
+Compares two result files written by the benchmarks and prints the change of
+every scenario, slower runs first.
+
+    $ python benchmarks/compare.py benchmarks/results/api-client-A.json benchmarks/results/api-client-B.json
+"""
+import argparse
+import json
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p95_ms", help="latency field to compare (p50_ms, p95_ms, p99_ms)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.candidate) as f:
+        candidate = json.load(f)["results"]
+
+    rows = []
+    for name in baseline:
+        if name not in candidate:
+            continue
+        before, after = baseline[name], candidate[name]
+        rows.append((name, before[args.metric], after[args.metric], change(before[args.metric], after[args.metric]),
+                     change(before["rps"], after["rps"])))
+    rows.sort(key=lambda row: -(row[3] or 0))
+
+    print(f"{'scenario':<34}{args.metric + ' A':>12}{args.metric + ' B':>12}{'latency':>10}{'rps':>10}")
+    for name, before, after, latency, rps in rows:
+        print(f"{name:<34}{before or 0:>12.3f}{after or 0:>12.3f}{latency or 0:>+9.1f}%{rps or 0:>+9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
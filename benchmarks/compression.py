@@ -0,0 +1,59 @@
+"""
+Size and time of the catalog list pages in each negotiated form: plain JSON,
+gzip, brotli and MessagePack, with the compressed body cache cold and warm.
+
+    $ python benchmarks/compression.py --rows 5000 --page 1000
+"""
+import argparse
+import time
+
+from common import load_app, save_results, seed
+
+VARIANTS = {
+    "json": {},
+    "gzip": {"Accept-Encoding": "gzip"},
+    "br": {"Accept-Encoding": "br"},
+    "msgpack": {"Accept": "application/msgpack"},
+    "msgpack+gzip": {"Accept": "application/msgpack", "Accept-Encoding": "gzip"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="rows per catalog table")
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    app = load_app()
+    seed(app, args.rows, args.rows, args.rows, users=1, favorites_per_user=0)
+    from compression import compressed_cache
+    from conditional import _validated
+
+    client = app.test_client()
+    results = {}
+    for name in ("planets", "characters", "vehicles"):
+        path = f"/{name}?limit={args.page}"
+        for variant, headers in VARIANTS.items():
+            compressed_cache.clear()
+            _validated.clear()
+            start = time.perf_counter()
+            response = client.get(path, headers=headers)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                client.get(path, headers=headers).get_data()
+            warm = (time.perf_counter() - start) / args.repeat
+            results[f"{name}:{variant}"] = {"bytes": len(response.get_data()),
+                                            "encoding": response.headers.get("Content-Encoding"),
+                                            "cold_ms": round(cold * 1000, 3), "warm_ms": round(warm * 1000, 3)}
+
+    print(f"{'page':<26}{'bytes':>10}{'cold ms':>10}{'warm ms':>10}")
+    for name, row in results.items():
+        print(f"{name:<26}{row['bytes']:>10}{row['cold_ms']:>10.3f}{row['warm_ms']:>10.3f}")
+    print("saved", save_results("compression", vars(args), results, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measures favorite lookups with and without the favorite indexes.
+
+Seeds a throwaway SQLite database with millions of favorite rows and times the
+queries the API runs: the favorites list of a user (get_all_favorites) and the
+(user_id, planet_id) lookup done by delete_favorite_planet.
+
+    $ python benchmarks/favorites_lookup.py --rows 2000000 --users 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from models import db, Favorite  # noqa: E402
+
+INDEXES = [index.name for index in Favorite.__table__.indexes]
+
+
+def seed(engine, rows, users, catalog, chunk=50000):
+    db.metadata.create_all(engine)
+    rng = random.Random(42)
+    insert = Favorite.__table__.insert()
+    seen = set()
+    with engine.begin() as conn:
+        done = 0
+        while done < rows:
+            batch = []
+            while len(batch) < min(chunk, rows - done):
+                user_id = rng.randint(1, users)
+                kind = rng.choice(("planet_id", "character_id", "vehicle_id"))
+                ref_id = rng.randint(1, catalog)
+                if (user_id, kind, ref_id) in seen:
+                    continue
+                seen.add((user_id, kind, ref_id))
+                batch.append({"user_id": user_id, "planet_id": None, "character_id": None,
+                              "vehicle_id": None, kind: ref_id})
+            conn.execute(insert, batch)
+            done += len(batch)
+    return list(seen)
+
+
+def time_queries(engine, users, pairs, lookups):
+    rng = random.Random(7)
+    planet_pairs = [p for p in pairs if p[1] == "planet_id"]
+    by_user = text("SELECT * FROM favorite WHERE user_id = :user_id")
+    by_pair = text("SELECT * FROM favorite WHERE user_id = :user_id AND planet_id = :planet_id LIMIT 1")
+    results = {}
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for _ in range(lookups):
+            conn.execute(by_user, {"user_id": rng.randint(1, users)}).fetchall()
+        results["favorites_by_user_ms"] = (time.perf_counter() - start) * 1000 / lookups
+        start = time.perf_counter()
+        for _ in range(lookups):
+            user_id, _kind, planet_id = rng.choice(planet_pairs)
+            conn.execute(by_pair, {"user_id": user_id, "planet_id": planet_id}).first()
+        results["favorite_by_user_and_planet_ms"] = (time.perf_counter() - start) * 1000 / lookups
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--catalog", type=int, default=5000, help="ids per catalog table")
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "favorites.db")
+    engine = create_engine(f"sqlite:///{path}")
+    start = time.perf_counter()
+    pairs = seed(engine, args.rows, args.users, args.catalog)
+    print(f"seeded {args.rows} favorites in {time.perf_counter() - start:.1f}s ({path})")
+
+    indexed = time_queries(engine, args.users, pairs, args.lookups)
+    with engine.begin() as conn:
+        for name in INDEXES:
+            conn.execute(text(f"DROP INDEX {name}"))
+    # the full scans are slow, a few lookups are enough to see the difference
+    scanned = time_queries(engine, args.users, pairs, max(1, args.lookups // 20))
+
+    print(f"{'query':<36}{'indexed':>12}{'no index':>12}")
+    for key in indexed:
+        print(f"{key:<36}{indexed[key]:>10.3f}ms{scanned[key]:>10.3f}ms")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
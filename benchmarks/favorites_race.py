@@ -0,0 +1,141 @@
+"""
+Concurrency stress test of the favorite writes against a multi-worker gunicorn.
+
+1. Double taps: every (user, planet) pair gets --taps simultaneous POSTs, half
+   of them retrying with the same Idempotency-Key. Exactly one of them may be a
+   201 that is not a replay.
+2. Churn: random adds and deletes of a small set of pairs from many threads,
+   one favorite per request and in /me/favorites/batch requests mixed together.
+
+Afterwards the favorite table must have no duplicated rows and every counter
+must match a recount. Exits with status 1 when any check fails.
+
+    $ python benchmarks/favorites_race.py --workers 4 --concurrency 32 --pairs 200 --taps 8
+"""
+import argparse
+import http.client
+import json
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from api import start_gunicorn
+from common import DEFAULT_DATABASE, auth_headers, load_app, seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pairs", type=int, default=200, help="(user, planet) pairs double tapped")
+    parser.add_argument("--taps", type=int, default=8, help="simultaneous requests per pair")
+    parser.add_argument("--churn", type=int, default=4000, help="random add/delete requests")
+    parser.add_argument("--batches", type=int, default=1000, help="batch requests mixed into the churn")
+    parser.add_argument("--port", type=int, default=5099)
+    cfg = parser.parse_args()
+    cfg.gunicorn_args = []
+
+    app = load_app(cfg.database)
+    seed(app, planets=500, characters=500, vehicles=500, users=100, favorites_per_user=0)
+
+    local = threading.local()
+
+    def call(method, path, user_id, key=None, body=None):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection("127.0.0.1", cfg.port, timeout=60)
+        headers = dict(auth_headers(user_id))
+        if key:
+            headers["Idempotency-Key"] = key
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            local.conn.request(method, path, body=body, headers=headers)
+            response = local.conn.getresponse()
+            response.read()
+            return response.status, response.getheader("Idempotent-Replayed") == "true"
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            return 0, False
+
+    failures = []
+    process = start_gunicorn(cfg)
+    try:
+        with ThreadPoolExecutor(max_workers=cfg.concurrency) as pool:
+            pairs = [(i % 100 + 1, i // 100 + 1) for i in range(cfg.pairs)]
+            calls = [("POST", f"/favorite/planets/{u}/{p}", f"tap-{u}-{p}" if tap % 2 else None, (u, p))
+                     for u, p in pairs for tap in range(cfg.taps)]
+            random.Random(1).shuffle(calls)
+            start = time.perf_counter()
+            outcomes = list(pool.map(lambda c: (c[3], *call(c[0], c[1], c[3][0], c[2])), calls))
+            elapsed = time.perf_counter() - start
+            # a replayed response repeats the 201 of the first attempt, it did not insert anything
+            created = Counter(pair for pair, status, replayed in outcomes if status == 201 and not replayed)
+            unexpected = Counter(status for _, status, _ in outcomes if status not in (200, 201))
+            print(f"double taps: {len(calls)} requests in {elapsed:.2f}s, statuses "
+                  f"{dict(Counter(s for _, s, _ in outcomes))}, {sum(r for _, _, r in outcomes)} replayed")
+            if unexpected:
+                failures.append(f"unexpected statuses {dict(unexpected)}")
+            if any(created[pair] != 1 for pair in pairs):
+                failures.append(f"{sum(created[pair] != 1 for pair in pairs)} pairs without exactly one 201")
+
+            rng = random.Random(2)
+            types = ["planet", "character", "vehicle"]
+            paths = {"POST": {"planet": "planets", "character": "characters", "vehicle": "vehicles"},
+                     "DELETE": {"planet": "planet", "character": "characters", "vehicle": "vehicles"}}
+            churn = []
+            for _ in range(cfg.churn):
+                method, user_id, ref_id, type_name = (rng.choice(["POST", "DELETE"]), rng.randint(1, 20),
+                                                      rng.randint(400, 410), rng.choice(types))
+                churn.append((method, f"/favorite/{paths[method][type_name]}/{user_id}/{ref_id}", user_id, None))
+            # the batches touch the same favorites as the single requests
+            for _ in range(cfg.batches):
+                operations = [{"op": rng.choice(["add", "remove"]), "type": rng.choice(types), "id": rng.randint(400, 410)}
+                              for _ in range(rng.randint(1, 6))]
+                churn.append(("POST", "/me/favorites/batch", rng.randint(1, 20), {"operations": operations}))
+            rng.shuffle(churn)
+            start = time.perf_counter()
+            statuses = list(pool.map(lambda c: call(c[0], c[1], c[2], body=c[3])[0], churn))
+            elapsed = time.perf_counter() - start
+            print(f"churn: {len(churn)} requests in {elapsed:.2f}s, statuses {dict(Counter(statuses))}")
+            # 409: a batch that hit a concurrent write, the client retries it
+            if any(s not in (200, 201, 404, 409) for s in statuses):
+                failures.append(f"unexpected churn statuses {dict(Counter(statuses))}")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+    from sqlalchemy import func
+    from models import db, Favorite, User, FAVORITE_TYPES
+    from counters import user_counter
+    with app.app_context():
+        for type_name, model in FAVORITE_TYPES.items():
+            column = getattr(Favorite, f"{type_name}_id")
+            rows = db.session.query(Favorite.user_id, column, func.count()).filter(column.isnot(None)) \
+                .group_by(Favorite.user_id, column).all()
+            duplicated = [r for r in rows if r[2] > 1]
+            if duplicated:
+                failures.append(f"{len(duplicated)} duplicated {type_name} favorites")
+            by_ref = Counter(r[1] for r in rows for _ in range(r[2]))
+            by_user = Counter(r[0] for r in rows for _ in range(r[2]))
+            stored = {i: n for i, n in db.session.query(model.id, model.favorite_count) if n}
+            if stored != dict(by_ref):
+                failures.append(f"{type_name}.favorite_count differs from the favorite table")
+            stored = {i: n for i, n in db.session.query(User.id, getattr(User, user_counter(type_name))) if n}
+            if stored != dict(by_user):
+                failures.append(f"user.{user_counter(type_name)} differs from the favorite table")
+
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("ok: one row per favorite and every counter matches")
+
+
+if __name__ == "__main__":
+    main()
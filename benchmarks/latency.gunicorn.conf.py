@@ -0,0 +1,22 @@
+"""
+gunicorn.conf.py of the project plus a fixed delay before every SQL statement
+(BENCH_DB_LATENCY_MS), to measure the worker classes against a database that
+is slower or further away than the local SQLite file. Used by serving.py.
+"""
+import os
+import time
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gunicorn.conf.py")) as _f:
+    exec(_f.read())
+
+_project_post_fork = post_fork  # noqa: F821, defined by the project settings
+
+
+def post_fork(server, worker):
+    _project_post_fork(server, worker)
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    delay = float(os.getenv("BENCH_DB_LATENCY_MS", 0)) / 1000
+
+    # time.sleep is looked up on every call, gevent workers patch it after post_fork
+    event.listen(Engine, "before_cursor_execute", lambda *args: time.sleep(delay))
@@ -0,0 +1,121 @@
+"""
+Cost of password hashing and what it does to the rest of the API.
+
+1. Milliseconds per hash and hashes per second with --threads threads for a few
+   scrypt (and argon2, when argon2-cffi is installed) settings, to choose them.
+2. Signup and login throughput against gunicorn with the settings of the
+   environment (SCRYPT_LOG_N, PASSWORD_HASH_THREADS, ...), and the latency of
+   GET /planets/<id> alone and while the logins run: the hashing threads must
+   not stall the other requests of the workers.
+
+    $ python benchmarks/passwords.py --workers 4 --concurrency 16 --requests 400
+    $ SCRYPT_LOG_N=14 python benchmarks/passwords.py --skip-costs
+"""
+import argparse
+import http.client
+import os
+import secrets
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api import run_http, scenarios, start_gunicorn
+from common import DEFAULT_DATABASE, load_app, print_table, save_results, seed, summarize
+
+SCRYPT_SETTINGS = [(14, 8, 1), (15, 8, 1), (16, 8, 1), (17, 8, 1)]
+ARGON2_SETTINGS = [(2, 19456, 1), (3, 65536, 1), (4, 262144, 1)]
+
+
+def measure(hash_once, threads, count):
+    """(ms per hash on one thread, hashes per second on `threads` threads)"""
+    start = time.perf_counter()
+    for _ in range(count):
+        hash_once()
+    single = (time.perf_counter() - start) / count
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: hash_once(), range(count * threads)))
+        parallel = count * threads / (time.perf_counter() - start)
+    return round(single * 1000, 2), round(parallel, 1)
+
+
+def costs(cfg):
+    from credentials import _scrypt
+    results = {}
+    for log_n, r, p in SCRYPT_SETTINGS:
+        salt = secrets.token_bytes(16)
+        results[f"scrypt ln={log_n} r={r} p={p} ({128 * r * 2 ** log_n // 2 ** 20} MiB)"] = \
+            measure(lambda: _scrypt("benchmark", salt, log_n, r, p), cfg.threads, cfg.hashes)
+    try:
+        from argon2 import PasswordHasher
+    except ImportError:
+        print("argon2-cffi is not installed, skipping argon2")
+    else:
+        for time_cost, memory_kib, parallelism in ARGON2_SETTINGS:
+            hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_kib, parallelism=parallelism)
+            results[f"argon2id t={time_cost} m={memory_kib // 1024}MiB p={parallelism}"] = \
+                measure(lambda: hasher.hash("benchmark"), cfg.threads, cfg.hashes)
+    print(f"{'settings':<40}{'ms/hash':>10}{f'hash/s x{cfg.threads}':>16}")
+    for name, (single, parallel) in results.items():
+        print(f"{name:<40}{single:>10.2f}{parallel:>16.1f}")
+    return {name: {"ms_per_hash": single, "hashes_per_second": parallel} for name, (single, parallel) in results.items()}
+
+
+def throughput(cfg):
+    selected = scenarios(cfg)
+    process = start_gunicorn(cfg)
+    try:
+        results = run_http(cfg, {name: selected[name] for name in ("create_user", "login", "login_wrong_password")})
+        results["get_planet"] = run_http(cfg, {"get_planet": selected["get_planet"]})["get_planet"]
+        # the same reads while --concurrency clients keep logging in
+        with ThreadPoolExecutor(max_workers=1) as background:
+            logins = background.submit(run_http, cfg, {"login": selected["login"]})
+            time.sleep(0.5)
+            conn = http.client.HTTPConnection("127.0.0.1", cfg.port, timeout=60)
+            start, latencies, errors = time.perf_counter(), [], 0
+            while not logins.done():
+                t0 = time.perf_counter()
+                conn.request("GET", f"/planets/{len(latencies) % cfg.planets + 1}")
+                response = conn.getresponse()
+                response.read()
+                latencies.append(time.perf_counter() - t0)
+                errors += response.status != 200
+            conn.close()
+            results["get_planet_during_logins"] = summarize(latencies, time.perf_counter() - start, errors)
+            results["login_with_reads"] = logins.result()["login"]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    print_table(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="threads hashing in the cost table")
+    parser.add_argument("--hashes", type=int, default=10, help="hashes per thread and setting in the cost table")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=400, help="signups and logins sent to gunicorn")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--skip-costs", action="store_true", help="only run the gunicorn part")
+    parser.add_argument("--output")
+    cfg = parser.parse_args()
+    cfg.planets = cfg.characters = cfg.vehicles = 1000
+    cfg.gunicorn_args = []
+
+    results = {} if cfg.skip_costs else {"costs": costs(cfg)}
+    app = load_app(cfg.database)
+    seed(app, cfg.planets, cfg.characters, cfg.vehicles, cfg.users, favorites_per_user=0)
+    results["gunicorn"] = throughput(cfg)
+    settings = {k: os.environ[k] for k in ("PASSWORD_SCHEME", "SCRYPT_LOG_N", "SCRYPT_R", "SCRYPT_P",
+                                           "PASSWORD_HASH_THREADS", "GUNICORN_WORKER_CLASS") if k in os.environ}
+    config = dict({k: v for k, v in vars(cfg).items() if k != "output"}, environment=settings)
+    print("saved", save_results("passwords", config, results, cfg.output))
+
+
+if __name__ == "__main__":
+    main()
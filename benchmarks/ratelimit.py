@@ -0,0 +1,57 @@
+"""
+Cost of one rate limit check with each backend of src/ratelimit.py, and of the
+before/after request hooks the limiter adds to every request.
+
+    $ python benchmarks/ratelimit.py --checks 200000 --clients 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import save_results
+
+
+def per_check_us(backend, checks, clients):
+    keys = [f"get_one_planet:10.0.{i // 256}.{i % 256}" for i in range(clients)]
+    start = time.perf_counter()
+    for i in range(checks):
+        backend.consume(keys[i % clients], 300, 5.0)
+    return (time.perf_counter() - start) / checks * 10 ** 6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    from common import load_app
+    import ratelimit
+    from ratelimit import MemoryBackend, SQLiteBackend
+    results = {"memory_check_us": round(per_check_us(MemoryBackend(), args.checks, args.clients), 3)}
+    with tempfile.TemporaryDirectory() as directory:
+        shared = SQLiteBackend(os.path.join(directory, "ratelimit.db"))
+        results["sqlite_check_us"] = round(per_check_us(shared, args.checks // 10, args.clients), 3)
+
+    # before/after request hooks as the app runs them, memory backend with a limit never reached
+    app = load_app()
+    ratelimit.backend = MemoryBackend()
+    ratelimit._default = ratelimit.parse_limit("1000000/second")
+    with app.test_request_context("/planets/1"):
+        responses = [app.response_class() for _ in range(args.checks)]
+        start = time.perf_counter()
+        for response in responses:
+            ratelimit._check_limit(app)
+            ratelimit._add_headers(response)
+        results["hooks_per_request_us"] = round((time.perf_counter() - start) / args.checks * 10 ** 6, 3)
+
+    for name, value in results.items():
+        print(f"{name:<30}{value:>10.3f}")
+    print("saved", save_results("ratelimit", vars(args), results, args.output))
+
+
+if __name__ == "__main__":
+    main()
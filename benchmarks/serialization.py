@@ -0,0 +1,99 @@
+"""
+Compares the ORM serialization path (Model.query + serialize() + jsonify) with
+the column tuple path of src/serializers.py used by the list and detail routes,
+and checks that both produce exactly the same bytes.
+
+    $ python benchmarks/serialization.py --rows 20000 --page 1000
+"""
+import argparse
+import time
+
+from common import load_app, save_results, seed
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="rows per catalog table")
+    parser.add_argument("--page", type=int, default=1000, help="rows serialized per response")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    app = load_app()
+    seed(app, args.rows, args.rows, args.rows, users=1, favorites_per_user=0)
+
+    from flask import jsonify
+    from sqlalchemy import select
+    from models import db, CATALOG_MODELS, Planet, Vehicle
+    from serializers import orjson, json_response, row_serializer, select_by_id
+    from utils import serialized_fields
+
+    with app.app_context():
+        # values the fast path has to fall back on to stay byte identical
+        db.session.get(Planet, 1).name = "Planète ñ"
+        db.session.get(Vehicle, 1).cost_in_credits = 1.5e17
+        db.session.get(Vehicle, 2).cost_in_credits = 3e-05
+        db.session.commit()
+
+    results = {}
+    with app.test_request_context():
+        for name, model in CATALOG_MODELS.items():
+            fields = serialized_fields(model)
+            columns = [getattr(model, f) for f in fields]
+            to_dict = row_serializer(fields)
+            by_id = select_by_id(model, fields)
+
+            def orm_list():
+                rows = model.query.order_by(model.id).limit(args.page).all()
+                return jsonify(list(map(lambda x: x.serialize(), rows))).get_data()
+
+            def fast_list():
+                rows = db.session.execute(select(*columns).order_by(model.id).limit(args.page)).all()
+                return json_response([to_dict(row) for row in rows]).get_data()
+
+            def orm_detail():
+                for entity_id in range(1, 101):
+                    jsonify(db.session.get(model, entity_id).serialize()).get_data()
+                    db.session.expunge_all()
+
+            def fast_detail():
+                for entity_id in range(1, 101):
+                    json_response(to_dict(db.session.execute(by_id, {"entity_id": entity_id}).first())).get_data()
+
+            assert orm_list() == fast_list(), f"{name}: list output differs"
+            for entity_id in (1, 2, 3):
+                orm = jsonify(db.session.get(model, entity_id).serialize()).get_data()
+                fast = json_response(to_dict(db.session.execute(by_id, {"entity_id": entity_id}).first())).get_data()
+                assert orm == fast, f"{name} {entity_id}: detail output differs"
+
+            timings = {}
+            for label, fn in (("orm_list", orm_list), ("fast_list", fast_list)):
+                db.session.expunge_all()
+                timings[label + "_ms"] = round(best_of(args.repeat, fn) * 1000, 3)
+            for label, fn in (("orm_detail_x100", orm_detail), ("fast_detail_x100", fast_detail)):
+                timings[label + "_ms"] = round(best_of(max(1, args.repeat // 4), fn) * 1000, 3)
+            timings["list_speedup"] = round(timings["orm_list_ms"] / timings["fast_list_ms"], 2)
+            timings["detail_speedup"] = round(timings["orm_detail_x100_ms"] / timings["fast_detail_x100_ms"], 2)
+            results[name] = timings
+            db.session.expunge_all()
+
+    print(f"json encoder: {'orjson' if orjson else 'stdlib'}, output identical for every model")
+    print(f"{'model':<12}{'orm list':>12}{'fast list':>12}{'x':>7}{'orm 100 get':>14}{'fast 100 get':>14}{'x':>7}")
+    for name, t in results.items():
+        print(f"{name:<12}{t['orm_list_ms']:>10.2f}ms{t['fast_list_ms']:>10.2f}ms{t['list_speedup']:>7}"
+              f"{t['orm_detail_x100_ms']:>12.2f}ms{t['fast_detail_x100_ms']:>12.2f}ms{t['detail_speedup']:>7}")
+    print("saved", save_results("serialization", {**vars(args), "encoder": "orjson" if orjson else "stdlib"},
+                                results, args.output))
+
+
+if __name__ == "__main__":
+    main()
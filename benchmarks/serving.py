@@ -0,0 +1,81 @@
+"""
+Compares gunicorn worker classes (see gunicorn.conf.py) on the same data and
+request mix: sync, the previous default, against gthread and gevent. With
+--db-latency-ms every SQL statement waits that long first, like a managed
+database over the network, which is where the sync workers fall behind.
+
+    $ python benchmarks/serving.py --workers 2 --concurrency 32
+    $ python benchmarks/serving.py --db-latency-ms 20 --worker-classes sync gthread gevent
+"""
+import argparse
+import os
+import signal
+import time
+
+from api import run_http, scenarios, start_gunicorn
+from common import DEFAULT_DATABASE, load_app, save_results, seed
+
+LATENCY_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "latency.gunicorn.conf.py")
+DEFAULT_SCENARIOS = ["get_planet", "list_planets", "favorites", "favorites_expand", "search", "add_favorite_planet",
+                     "delete_favorite_planet"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-classes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="threads per gthread worker")
+    parser.add_argument("--worker-connections", type=int, default=100, help="greenlets per gevent worker")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--planets", type=int, default=5000)
+    parser.add_argument("--characters", type=int, default=5000)
+    parser.add_argument("--vehicles", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--favorites-per-user", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario, scaled by its share")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--only", nargs="*", default=DEFAULT_SCENARIOS, help="scenarios of benchmarks/api.py to run")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--output")
+    cfg = parser.parse_args()
+    cfg.gunicorn_args = []
+
+    app = load_app(cfg.database)
+    seed(app, cfg.planets, cfg.characters, cfg.vehicles, cfg.users, cfg.favorites_per_user)
+    selected = {name: s for name, s in scenarios(cfg).items() if name in cfg.only}
+
+    results = {}
+    for worker_class in cfg.worker_classes:
+        env = {"GUNICORN_WORKER_CLASS": worker_class, "GUNICORN_THREADS": str(cfg.threads),
+               "GUNICORN_WORKER_CONNECTIONS": str(cfg.worker_connections),
+               "BENCH_DB_LATENCY_MS": str(cfg.db_latency_ms)}
+        process = start_gunicorn(cfg, env, LATENCY_CONFIG)
+        try:
+            start = time.perf_counter()
+            by_scenario = run_http(cfg, selected)
+            elapsed = time.perf_counter() - start
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+        requests = sum(r["requests"] for r in by_scenario.values())
+        results[worker_class] = {
+            "rps": round(requests / elapsed, 1),
+            "errors": sum(r["errors"] for r in by_scenario.values()),
+            "worst_p95_ms": max(r["p95_ms"] for r in by_scenario.values()),
+            "scenarios": by_scenario,
+        }
+
+    print(f"{cfg.workers} workers, {cfg.concurrency} clients, {cfg.db_latency_ms}ms added per SQL statement")
+    print(f"{'worker class':<14}{'rps':>10}{'worst p95 ms':>14}{'errors':>8}" +
+          "".join(f"{name[:16]:>18}" for name in selected))
+    for worker_class, row in results.items():
+        print(f"{worker_class:<14}{row['rps']:>10.1f}{row['worst_p95_ms']:>14.3f}{row['errors']:>8}" +
+              "".join(f"{row['scenarios'][name]['rps']:>14.1f} rps" for name in selected))
+    config = {k: v for k, v in vars(cfg).items() if k not in ("output", "gunicorn_args")}
+    print("saved", save_results("serving", config, results, cfg.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Startup cost of the app.
+
+1. Seconds to import src/app.py and run create_app() in a fresh interpreter,
+   API only, with the admin (ENABLE_ADMIN=true) and as the flask command line
+   does it (Flask-Migrate loaded).
+2. Seconds from launching gunicorn to its first answer, and memory of each
+   worker (PSS and private, from /proc, Linux only) with and without
+   preload_app.
+
+    $ python benchmarks/startup.py --repeat 10 --workers 4
+"""
+import argparse
+import http.client
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+from api import start_gunicorn
+from common import DEFAULT_DATABASE, SRC, load_app, save_results, seed
+
+BUILD = ("import time; start = time.perf_counter(); from app import create_app; imported = time.perf_counter(); "
+         "create_app(); print(imported - start, time.perf_counter() - start)")
+VARIANTS = {
+    "api": {},
+    "admin": {"ENABLE_ADMIN": "true"},
+    "cli": {"FLASK_RUN_FROM_CLI": "true"},
+}
+
+
+def build_times(cfg, env):
+    imports, totals = [], []
+    for _ in range(cfg.repeat):
+        output = subprocess.run([sys.executable, "-c", BUILD], cwd=SRC, capture_output=True, text=True, check=True,
+                                env=dict(os.environ, DATABASE_URL=cfg.database, **env)).stdout
+        imported, total = map(float, output.split())
+        imports.append(imported)
+        totals.append(total)
+    return {"import_ms": round(statistics.median(imports) * 1000, 1),
+            "create_app_ms": round(statistics.median(totals) * 1000, 1)}
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # the command is in parentheses and may contain spaces, the parent pid follows it
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return found
+
+
+def memory_kb(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if rest.strip().endswith("kB"):
+                values[name] = int(rest.split()[0])
+    return values.get("Pss", 0), values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+
+
+def serve(cfg, preload):
+    start = time.perf_counter()
+    process = start_gunicorn(cfg, {"GUNICORN_PRELOAD": str(preload).lower()})
+    ready = time.perf_counter() - start
+    try:
+        # warm every worker a bit so their memory includes the first requests
+        for i in range(cfg.workers * 20):
+            conn = http.client.HTTPConnection("127.0.0.1", cfg.port, timeout=10)
+            conn.request("GET", f"/planets/{i % 100 + 1}")
+            conn.getresponse().read()
+            conn.close()
+        workers = children(process.pid)
+        memory = [memory_kb(pid) for pid in workers]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    return {"first_response_s": round(ready, 3), "workers": len(workers),
+            "worker_pss_mb": round(statistics.mean(m[0] for m in memory) / 1024, 1) if memory else None,
+            "worker_private_mb": round(statistics.mean(m[1] for m in memory) / 1024, 1) if memory else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--repeat", type=int, default=10, help="fresh interpreters per variant")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--output")
+    cfg = parser.parse_args()
+    cfg.gunicorn_args = []
+
+    seed(load_app(cfg.database), 1000, 1000, 1000, users=10, favorites_per_user=0)
+    results = {}
+    for name, env in VARIANTS.items():
+        results[name] = build_times(cfg, env)
+        print(f"{name:<8}import {results[name]['import_ms']:>8.1f} ms   create_app {results[name]['create_app_ms']:>8.1f} ms")
+    if os.path.exists("/proc/self/smaps_rollup"):
+        for preload in (False, True):
+            name = "gunicorn_preload" if preload else "gunicorn"
+            results[name] = serve(cfg, preload)
+            print(name, results[name])
+    print("saved", save_results("startup", vars(cfg), results, cfg.output))
+
+
+if __name__ == "__main__":
+    main()
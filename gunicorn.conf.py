@@ -0,0 +1,80 @@
+"""
+Gunicorn settings, loaded with --config by the Procfile and render.yaml.
+
+    GUNICORN_WORKER_CLASS        sync, gthread or gevent (gthread)
+    WEB_CONCURRENCY              worker processes (2 * cpus + 1, at most 4)
+    GUNICORN_THREADS             threads per gthread worker (8)
+    GUNICORN_WORKER_CONNECTIONS  concurrent requests per gevent worker (100)
+    GUNICORN_TIMEOUT             seconds before a silent worker is restarted (30)
+    GUNICORN_KEEPALIVE           seconds to keep idle client connections open (5)
+    GUNICORN_MAX_REQUESTS        restart workers after this many requests, 0 never (0)
+    GUNICORN_PRELOAD             build the app once in the master before forking the
+                                 workers (true, false for gevent)
+
+A sync worker serves one request at a time, so a slow query blocks the whole
+process. gthread and gevent workers keep serving other requests while one waits
+on the database. db.session is scoped to the Flask application context, which
+is per thread and per greenlet, so handlers need no change for either mode.
+
+With preload_app the workers are forked from a master that already imported
+and built the app, so they start faster and share its memory copy-on-write.
+gevent workers do not preload: the standard library has to be monkey patched
+before the app imports it.
+
+Every concurrent request may hold a database connection, so unless DB_POOL_SIZE
+is set the pool grows with the concurrency of the worker (see src/database.py).
+Password hashes are memory hard and run on PASSWORD_HASH_THREADS threads per
+worker, the cpus divided by the workers unless it is set.
+"""
+import multiprocessing
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.getenv("GUNICORN_THREADS", 8)) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("GUNICORN_PRELOAD", str(worker_class != "gevent")).lower() in ("1", "true", "yes")
+
+if worker_class == "gthread":
+    os.environ.setdefault("DB_POOL_SIZE", str(threads))
+    os.environ.setdefault("DB_MAX_OVERFLOW", "0")
+elif worker_class == "gevent":
+    # the greenlets of a worker share a bounded pool, the rest wait for a connection (DB_POOL_TIMEOUT)
+    os.environ.setdefault("DB_POOL_SIZE", str(min(worker_connections, 20)))
+    os.environ.setdefault("DB_MAX_OVERFLOW", "10")
+
+# each worker hashes passwords on its own threads (src/credentials.py), share the cpus between them
+os.environ.setdefault("PASSWORD_HASH_THREADS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        # connections opened in the master while the app was built must not be shared by the workers
+        from models import db
+        with server.app.wsgi().app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+    if server.cfg.worker_class_str != "gevent":
+        return
+    # gunicorn monkey patches the standard library in each gevent worker, psycopg2 is a C
+    # extension and needs psycogreen to yield to other greenlets while waiting on PostgreSQL
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed, PostgreSQL queries will block the gevent worker")
+        return
+    patch_psycopg()
+
+
+def when_ready(server):
+    cfg = server.cfg
+    server.log.info("serving with %d %s workers (threads %d, worker connections %d, preload %s)",
+                    cfg.workers, cfg.worker_class_str, cfg.threads, cfg.worker_connections, cfg.preload_app)
@@ -77,6 +77,13 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the full text search tables are not models (see src/search.py), without this
+    # autogenerate would try to drop them on every migrate
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and name.startswith('catalog_search'):
+            return False
+        return True
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
@@ -84,6 +91,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
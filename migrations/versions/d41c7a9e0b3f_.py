@@ -0,0 +1,40 @@
+"""favorite indexes and unique favorites
+
+Revision ID: d41c7a9e0b3f
+Revises: a9baaff4242b
+Create Date: 2026-10-18 10:12:41.208517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e0b3f'
+down_revision = 'a9baaff4242b'
+branch_labels = None
+depends_on = None
+
+
+FAVORITE_COLUMNS = ('planet_id', 'character_id', 'vehicle_id')
+
+
+def upgrade():
+    # keep only the oldest row of every duplicated favorite so the unique indexes can be built
+    for column in FAVORITE_COLUMNS:
+        op.execute(
+            f'DELETE FROM favorite WHERE {column} IS NOT NULL AND id NOT IN '
+            f'(SELECT MIN(id) FROM favorite WHERE {column} IS NOT NULL GROUP BY user_id, {column})'
+        )
+
+    op.create_index('ix_favorite_user_id', 'favorite', ['user_id'], unique=False)
+    for column in FAVORITE_COLUMNS:
+        where = sa.text(f'{column} IS NOT NULL')
+        op.create_index(f'uq_favorite_user_{column[:-3]}', 'favorite', ['user_id', column], unique=True,
+                        postgresql_where=where, sqlite_where=where)
+
+
+def downgrade():
+    for column in FAVORITE_COLUMNS:
+        op.drop_index(f'uq_favorite_user_{column[:-3]}', table_name='favorite')
+    op.drop_index('ix_favorite_user_id', table_name='favorite')
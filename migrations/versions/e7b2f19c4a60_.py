@@ -0,0 +1,43 @@
+"""catalog filter and name search indexes
+
+Revision ID: e7b2f19c4a60
+Revises: d41c7a9e0b3f
+Create Date: 2026-10-18 10:31:05.114392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2f19c4a60'
+down_revision = 'd41c7a9e0b3f'
+branch_labels = None
+depends_on = None
+
+
+FILTER_INDEXES = [
+    ('ix_planet_climate', 'planet', ['climate', 'id']),
+    ('ix_planet_terrain', 'planet', ['terrain', 'id']),
+    ('ix_character_gender', 'character', ['gender', 'id']),
+    ('ix_vehicle_manufacturer', 'vehicle', ['manufacturer', 'id']),
+    ('ix_vehicle_cost_in_credits', 'vehicle', ['cost_in_credits', 'id']),
+]
+NAME_TABLES = ['planet', 'character', 'vehicle']
+
+
+def upgrade():
+    for name, table, columns in FILTER_INDEXES:
+        op.create_index(name, table, columns, unique=False)
+    # lower(name) for the case insensitive prefix search, with the pattern operator
+    # class on PostgreSQL so LIKE 'abc%' can use it whatever the database collation is
+    opclass = ' varchar_pattern_ops' if op.get_bind().dialect.name == 'postgresql' else ''
+    for table in NAME_TABLES:
+        op.execute(f'CREATE INDEX ix_{table}_name_lower ON "{table}" (lower(name){opclass})')
+
+
+def downgrade():
+    for table in NAME_TABLES:
+        op.drop_index(f'ix_{table}_name_lower', table_name=table)
+    for name, table, columns in FILTER_INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,56 @@
+"""full text search index for the catalog
+
+Revision ID: f3a8d6e1c925
+Revises: e7b2f19c4a60
+Create Date: 2026-10-18 10:48:22.730158
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8d6e1c925'
+down_revision = 'e7b2f19c4a60'
+branch_labels = None
+depends_on = None
+
+
+# must match SEARCHABLE and TYPE_CODES in src/search.py
+SEARCHABLE = [
+    ('planets', 'planet', 1, ['climate', 'terrain', 'gravity']),
+    ('characters', 'character', 2, ['gender', 'hair_color', 'skin_color', 'eye_color', 'birth_year']),
+    ('vehicles', 'vehicle', 3, ['model', 'manufacturer']),
+]
+
+
+def body_sql(columns):
+    return " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for _, table, _, columns in SEARCHABLE:
+            document = (f"setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                        f"setweight(to_tsvector('simple', {body_sql(columns)}), 'B')")
+            op.execute(f'CREATE INDEX ix_{table}_search ON "{table}" USING GIN (({document}))')
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE catalog_search USING fts5("
+            "type UNINDEXED, ref_id UNINDEXED, name, body, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        for type_name, table, code, columns in SEARCHABLE:
+            op.execute(
+                f"INSERT INTO catalog_search (rowid, type, ref_id, name, body) "
+                f"SELECT id * 4 + {code}, '{type_name}', id, name, {body_sql(columns)} FROM \"{table}\""
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for _, table, _, _ in SEARCHABLE:
+            op.drop_index(f'ix_{table}_search', table_name=table)
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE catalog_search')
@@ -1,20 +1,177 @@
 import os
+from flask import g, request
 from flask_admin import Admin
+from sqlalchemy import func, text
+from sqlalchemy.orm import joinedload
 from models import db, User, Planet,Character,Vehicle,Favorite
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual, IntEqualFilter
+from cache import TTLCache, invalidate
+from credentials import hash_password, is_hashed
+from auth import revoke_user_tokens
+
+
+# table -> number of rows shown above the lists, refreshed every ADMIN_COUNT_TTL seconds
+_estimates = TTLCache(maxsize=64, ttl=float(os.getenv("ADMIN_COUNT_TTL", 60)))
+
+
+def estimated_count(session, model):
+    """Rows of the table, from the planner statistics on PostgreSQL instead of a COUNT(*)"""
+    table = model.__tablename__
+    count = _estimates.get(table)
+    if count is None:
+        if db.engine.dialect.name == "postgresql":
+            count = session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(quote_ident(:table))"),
+                {"table": table}
+            ).scalar()
+        # other databases, or a table never analyzed (-1, 0 before PostgreSQL 14): count it
+        if not count or count < 0:
+            count = session.query(func.count()).select_from(model).scalar()
+        _estimates.set(table, count)
+    return count
+
+
+class LargeTableModelView(ModelView):
+    """
+    List that stays fast with millions of rows: no COUNT(*) per page (the
+    estimate above the list comes from estimated_count) and, with the default
+    order (newest first), the next and previous pages start after the last id
+    shown (?after=<id>, ?before=<id>) instead of skipping rows with OFFSET.
+    Sorting by a column or jumping to a ?page= without a cursor still pages
+    with OFFSET, so only indexed columns are sortable and filterable.
+    """
+    list_template = "admin/large_list.html"
+    simple_list_pager = True
+    page_size = 50
+    can_set_page_size = True
+    column_display_pk = True
+    column_sortable_list = ("id",)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        if execute and not search and not filters:
+            self._template_args["estimated_count"] = estimated_count(self.session, self.model)
+        if sort_column is not None or not execute:
+            return super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        page_size = page_size or self.page_size
+        # the search, filters and eager loads of Flask-Admin, without its order and pages
+        _, query = super().get_list(0, None, False, search, filters, execute=False, page_size=0)
+        pk = self.model.id
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
+        if before is not None:
+            rows = query.filter(pk > before).order_by(pk.asc()).limit(page_size).all()[::-1]
+        elif after is not None:
+            rows = query.filter(pk < after).order_by(pk.desc()).limit(page_size).all()
+        else:
+            rows = query.order_by(pk.desc()).limit(page_size).offset(page * page_size).all()
+        if rows:
+            g._admin_keyset = (page, rows[0].id, rows[-1].id)
+        return None, rows
+
+    def _get_list_url(self, view_args):
+        # the pager asks for the page before or after this one, give it the cursor of that page
+        extra_args = {k: v for k, v in view_args.extra_args.items() if k not in ("after", "before")}
+        keyset = g.get("_admin_keyset")
+        if keyset and view_args.sort is None and view_args.page:
+            page, first_id, last_id = keyset
+            if view_args.page == page + 1:
+                extra_args["after"] = last_id
+            elif view_args.page == page - 1:
+                extra_args["before"] = first_id
+            elif view_args.page == page:
+                extra_args.update({k: v for k, v in view_args.extra_args.items() if k in ("after", "before")})
+        return super()._get_list_url(view_args.clone(extra_args=extra_args))
+
+
+class CatalogModelView(LargeTableModelView):
+    # maintained by counters.py, editing it by hand would only make it wrong
+    form_excluded_columns = ("favorite_count",)
+
+    # evict the cached serialize() output as soon as the admin saves or deletes a row,
+    # cache.py does the same for every other committed session
+    def after_model_change(self, form, model, is_created):
+        invalidate(self.model, model.id)
+
+    def after_model_delete(self, model):
+        invalidate(self.model, model.id)
+
+
+class PlanetModelView(CatalogModelView):
+    column_sortable_list = ("id", "name", "favorite_count")
+    column_filters = (FilterEqual(Planet.climate, "Climate"), FilterEqual(Planet.terrain, "Terrain"))
+
+
+class CharacterModelView(CatalogModelView):
+    column_sortable_list = ("id", "name", "favorite_count")
+    column_filters = (FilterEqual(Character.gender, "Gender"),)
+
+
+class VehicleModelView(CatalogModelView):
+    column_sortable_list = ("id", "name", "favorite_count", "cost_in_credits")
+    column_filters = (FilterEqual(Vehicle.manufacturer, "Manufacturer"),)
+
+
+class UserModelView(LargeTableModelView):
+    form_excluded_columns = ("favorite_planet_count", "favorite_character_count", "favorite_vehicle_count")
+    column_exclude_list = ("password",)
+    column_sortable_list = ("id", "email")
+    column_filters = (FilterEqual(User.email, "Email"),)
+
+    # a password typed in the admin is stored hashed like the ones of POST /user
+    def on_model_change(self, form, model, is_created):
+        if model.password and not is_hashed(model.password):
+            model.password = hash_password(model.password)
+        # a deactivated user is logged out everywhere
+        if not is_created and not model.is_active and form.is_active.object_data:
+            revoke_user_tokens(self.session, model.id)
+
+    def after_model_delete(self, model):
+        revoke_user_tokens(self.session, model.id)
+        self.session.commit()
+
+
+class FavoriteModelView(LargeTableModelView):
+    column_list = ("id", "user", "planet", "character", "vehicle")
+    # ix_favorite_user_id, a planet, character or vehicle alone has no index to filter on
+    column_filters = (IntEqualFilter(Favorite.user_id, "User id"),)
+    # the names come in the same query as the page, not with one query per row
+    column_auto_select_related = False
+    column_formatters = {
+        "user": lambda view, context, model, name: getattr(model.user, "email", ""),
+        "planet": lambda view, context, model, name: getattr(model.planet, "name", ""),
+        "character": lambda view, context, model, name: getattr(model.character, "name", ""),
+        "vehicle": lambda view, context, model, name: getattr(model.vehicle, "name", ""),
+    }
+
+    # the forms search users and catalog rows as they are typed instead of listing all of them
+    form_ajax_refs = {
+        "user": {"fields": ("email",), "page_size": 10},
+        "planet": {"fields": ("name",), "page_size": 10},
+        "character": {"fields": ("name",), "page_size": 10},
+        "vehicle": {"fields": ("name",), "page_size": 10},
+    }
+
+    def get_query(self):
+        return super().get_query().options(
+            joinedload(Favorite.user).load_only(User.email),
+            joinedload(Favorite.planet).load_only(Planet.name),
+            joinedload(Favorite.character).load_only(Character.name),
+            joinedload(Favorite.vehicle).load_only(Vehicle.name),
+        )
+
 
 def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Vehicle, db.session))
-    admin.add_view(ModelView(Favorite, db.session))
+    admin.add_view(UserModelView(User, db.session))
+    admin.add_view(PlanetModelView(Planet, db.session))
+    admin.add_view(CharacterModelView(Character, db.session))
+    admin.add_view(VehicleModelView(Vehicle, db.session))
+    admin.add_view(FavoriteModelView(Favorite, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
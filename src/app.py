@@ -1,256 +1,565 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+
+The routes live in the `api` blueprint and create_app() builds the app, so
+importing this module is cheap. Flask-Admin is only loaded with ENABLE_ADMIN=true
+and Flask-Migrate (which imports alembic) only for the flask command line.
 """
-import os, json
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import os
+from collections import Counter
+from flask import Flask, Blueprint, current_app, request, jsonify, url_for, Response, stream_with_context
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Character,Planet,Vehicle,Favorite
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from utils import serialized_fields, ValidationError, NotFoundError, ConflictError, UnauthorizedError, setup_error_handlers, MAX_PAGE_SIZE, parse_ids, is_filtered, generate_sitemap, keyset_page, paginated_response, parse_fields, stream_rows
+from database import configure_database
+from commands import setup_commands
+from instrumentation import setup_instrumentation
+from compression import setup_compression
+from ratelimit import setup_rate_limit, rate_limit, WRITE_LIMIT, EXPENSIVE_LIMIT
+from cache import get_serialized, get_serialized_many, entity_cache
+from conditional import conditional, setup_conditional
+from serializers import json_response
+from search import search, search_terms, SEARCHABLE
+from counters import favorite_summary, top_favorited, favorite_counts
+from favorites import add_favorite, remove_favorite, apply_pending_counters, EXISTS, NOT_FOUND, USER_NOT_FOUND
+from idempotency import idempotent
+from credentials import hash_password, verify_password
+from auth import issue_token, current_user_id, login_required, owner_required, revoke_current_token
+from models import db, User, Character,Planet,Vehicle,Favorite, CATALOG_MODELS, FAVORITE_TYPES
 #from models import Person
-#AQUI SE TRABAJAN LAS RUTAS, TRABAJAR DESPUES DE LA LINEA 34
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
-
-# Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
-def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+
+#AQUI SE TRABAJAN LAS RUTAS
+api = Blueprint("api", __name__)
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
+
+#Estadisticas del cache de planetas, personajes y vehiculos
+@api.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(entity_cache.stats()), 200
 
 #Obtener todos los usuarios
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
+@rate_limit(EXPENSIVE_LIMIT)
+@conditional('user')
 def get_all_users():
-    try:
-        users=User.query.all()
-        if len(users)<1:
-            return jsonify({"msg":"not found"}),404
-        serialized_users=list(map(lambda x: x.serialize(),users))
-        return serialized_users, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    users=User.query.all()
+    if len(users)<1:
+        raise NotFoundError("not found")
+    serialized_users=list(map(lambda x: x.serialize(),users))
+    return serialized_users, 200
     
 #Obtener usuario por ID
-@app.route('/user/<int:user_id>', methods=['GET'])
+@api.route('/user/<int:user_id>', methods=['GET'])
+@conditional('user')
 def get_one_user(user_id):
-    try:
-        user=User.query.get(user_id)
-        if user is None:
-            return jsonify({"msg":f"user {user_id} not found"}), 404
-        serialized_user=user.serialize()
-        return serialized_user, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    user=User.query.get(user_id)
+    if user is None:
+        raise NotFoundError(f"user {user_id} not found")
+    serialized_user=user.serialize()
+    return serialized_user, 200
     
 #crear usuario
-@app.route('/user', methods=['POST'])
+@api.route('/user', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
 def create_one_user():
+    body=request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("email"), str) or not isinstance(body.get("password"), str):
+        raise ValidationError("email and password are required")
+    # hashed before the session is used so no connection is held while it runs
+    new_user=User(
+        email=body["email"],
+        password=hash_password(body["password"]),
+        is_active=True
+    )
+    db.session.add(new_user)
     try:
-        body=json.loads(request.data)
-        new_user=User(
-            email=body["email"],
-            password=body["password"],
-            is_active=True
-        )
-        db.session.add(new_user)
         db.session.commit()
-        return jsonify({"msg":"User created succesfully"}),201
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    except IntegrityError:
+        raise ConflictError(f"a user with email {body['email']} already exists")
+    return jsonify({"msg":"User created succesfully"}),201
+
+#iniciar sesion
+@api.route('/login', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+def login():
+    body=request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("email"), str) or not isinstance(body.get("password"), str):
+        raise ValidationError("email and password are required")
+    user=User.query.filter_by(email=body["email"]).first()
+    stored=user.password if user is not None else None
+    # give the connection back to the pool while the password is checked, user stays loaded
+    db.session.close()
+    matches, new_hash=verify_password(body["password"], stored)
+    if not matches or not user.is_active:
+        raise UnauthorizedError("invalid email or password")
+    if new_hash is not None:
+        # hashed with older settings or still in plaintext, store it with the current ones
+        User.query.filter_by(id=user.id, password=stored).update({"password": new_hash})
+        db.session.commit()
+    token, expires_in=issue_token(user.id)
+    return jsonify({"msg":"login succesful", "user": user.serialize(), "token": token, "expires_in": expires_in}), 200
+
+#cerrar sesion, el token deja de servir
+@api.route('/logout', methods=['POST'])
+@login_required
+def logout():
+    revoke_current_token(db.session)
+    db.session.commit()
+    return jsonify({"msg":"logout succesful"}), 200
 #editar usuario
 #borrar el usuario
 #Traer lista de favoritos del usuario
-@app.route('/user/<int:user_id>/favorites', methods=['GET'])
-def get_all_favorites(user_id):
+def user_favorites(user_id):
+    if request.args.get("expand", "").lower() in ("1", "true", "yes"):
+        # una sola consulta con LEFT OUTER JOIN a planet, character y vehicle
+        favorites=Favorite.query.options(
+            joinedload(Favorite.planet),
+            joinedload(Favorite.character),
+            joinedload(Favorite.vehicle)
+        ).filter_by(user_id=user_id).all()
+        serialized_favorites=list(map(lambda x: x.serialize_expanded(),favorites))
+        return serialized_favorites, 200
     favorites=Favorite.query.filter_by(user_id=user_id).all()
     serialized_favorites=list(map(lambda x: x.serialize(),favorites))
     return serialized_favorites, 200
 
+# las rutas /user/<user_id>/... solo las puede usar el dueño del token, /me/... toma el usuario del token
+@api.route('/user/<int:user_id>/favorites', methods=['GET'])
+@owner_required
+@conditional('favorite', 'planet', 'character', 'vehicle', private=True)
+def get_all_favorites(user_id):
+    return user_favorites(user_id)
+
+@api.route('/me/favorites', methods=['GET'])
+@login_required
+@conditional('favorite', 'planet', 'character', 'vehicle', private=True)
+def get_my_favorites():
+    return user_favorites(current_user_id())
+
+#Cantidad de favoritos del usuario por tipo, leida de los contadores de la tabla user
+def user_favorites_summary(user_id):
+    summary = favorite_summary(db.session, user_id)
+    if summary is None:
+        raise NotFoundError(f"User {user_id} not found")
+    return jsonify({"user_id": user_id, **summary}), 200
+
+@api.route('/user/<int:user_id>/favorites/summary', methods=['GET'])
+@owner_required
+@conditional('favorite', private=True)
+def get_favorites_summary(user_id):
+    return user_favorites_summary(user_id)
+
+@api.route('/me/favorites/summary', methods=['GET'])
+@login_required
+@conditional('favorite', private=True)
+def get_my_favorites_summary():
+    return user_favorites_summary(current_user_id())
+
+MAX_BATCH_OPERATIONS = 500
+
+#Agregar y borrar varios favoritos en una sola transaccion
+@api.route('/user/<int:user_id>/favorites/batch', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
+@idempotent
+def batch_favorites(user_id):
+    return apply_favorites_batch(user_id)
+
+@api.route('/me/favorites/batch', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@login_required
+@idempotent
+def batch_my_favorites():
+    return apply_favorites_batch(current_user_id())
+
+def apply_favorites_batch(user_id):
+    body = request.get_json(silent=True) or {}
+    operations = body.get("operations")
+    if not isinstance(operations, list) or len(operations) < 1:
+        raise ValidationError("operations must be a non empty list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValidationError(f"at most {MAX_BATCH_OPERATIONS} operations per batch")
+    for operation in operations:
+        if (not isinstance(operation, dict) or operation.get("op") not in ("add", "remove")
+                or operation.get("type") not in FAVORITE_TYPES or type(operation.get("id")) is not int):
+            raise ValidationError("every operation needs op (add|remove), type (planet|character|vehicle) and an integer id",
+                               payload={"operation": operation})
+
+    # un IN por tipo para validar los ids y una consulta para los favoritos que ya existen
+    ids_by_type = {}
+    for operation in operations:
+        ids_by_type.setdefault(operation["type"], set()).add(operation["id"])
+    found = {}
+    for type_name, ids in ids_by_type.items():
+        model = FAVORITE_TYPES[type_name]
+        found[type_name] = {row.id for row in db.session.query(model.id).filter(model.id.in_(ids))}
+    existing = set()
+    conditions = [getattr(Favorite, f"{type_name}_id").in_(ids) for type_name, ids in ids_by_type.items()]
+    columns = [getattr(Favorite, f"{type_name}_id") for type_name in FAVORITE_TYPES]
+    for row in db.session.query(*columns).filter(Favorite.user_id == user_id, or_(*conditions)):
+        for type_name, ref_id in zip(FAVORITE_TYPES, row):
+            if ref_id is not None:
+                existing.add((type_name, ref_id))
+
+    # se resuelve todo el lote en memoria primero, asi agregar y borrar el mismo favorito
+    # dentro del lote no choca con los indices unicos al hacer el flush
+    to_add = set()
+    to_remove = set()
+    # resultado de la operacion de la que sale cada escritura, se corrige con lo que paso en la base
+    writes = {}
+    results = []
+    for operation in operations:
+        key = (operation["type"], operation["id"])
+        result = {"op": operation["op"], "type": operation["type"], "id": operation["id"]}
+        is_favorite = key in to_add or (key in existing and key not in to_remove)
+        if operation["op"] == "add":
+            if operation["id"] not in found[operation["type"]]:
+                result.update(status=404, msg=f"{operation['type']} not found")
+            elif is_favorite:
+                result.update(status=200, msg="already in favorites")
+            else:
+                if key in to_remove:
+                    to_remove.discard(key)
+                    del writes[key]
+                else:
+                    to_add.add(key)
+                    writes[key] = result
+                result.update(status=201, msg="added to favorites")
+        else:
+            if not is_favorite:
+                result.update(status=404, msg="favorite not found")
+            else:
+                if key in to_add:
+                    to_add.discard(key)
+                    del writes[key]
+                else:
+                    to_remove.add(key)
+                    writes[key] = result
+                result.update(status=200, msg="favorite deleted")
+        results.append(result)
+    # las mismas escrituras que las rutas de un favorito: los contadores se ajustan con las
+    # filas que la base de datos realmente inserto o borro, no con lo que se leyo antes,
+    # y se escriben juntos al final para tener el lock de escritura el menor tiempo posible
+    pending = Counter()
+    # si otra peticion se adelanto el resultado dice lo que realmente paso
+    for type_name, ref_id in sorted(to_remove):
+        if not remove_favorite(db.session, user_id, type_name, ref_id, pending):
+            writes[(type_name, ref_id)].update(status=404, msg="favorite not found")
+    for type_name, ref_id in sorted(to_add):
+        outcome = add_favorite(db.session, user_id, type_name, ref_id, pending)
+        if outcome == EXISTS:
+            writes[(type_name, ref_id)].update(status=200, msg="already in favorites")
+        elif outcome == NOT_FOUND:
+            writes[(type_name, ref_id)].update(status=404, msg=f"{type_name} not found")
+        elif outcome == USER_NOT_FOUND:
+            writes[(type_name, ref_id)].update(status=404, msg=f"User {user_id} not found")
+    apply_pending_counters(db.session, pending)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        raise ConflictError("favorites changed while the batch was applied, retry the batch")
+    return jsonify({"results": results}), 200
+
+#Varios por id en una sola llamada (/planets?ids=3,1,2): los que no estan en el cache
+#se leen con un solo IN, en el orden pedido y con la lista de los que no existen
+def multi_get_response(model):
+    unknown = [key for key in request.args if key not in ("ids", "fields")]
+    if unknown:
+        raise ValidationError(f"ids can only be combined with fields, not with {', '.join(unknown)}")
+    ids = parse_ids(request.args["ids"])
+    fields = parse_fields(model)
+    found = get_serialized_many(model, ids)
+    if len(fields) < len(serialized_fields(model)):
+        found = {i: {f: item[f] for f in fields} for i, item in found.items()}
+    return json_response({
+        "results": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found]
+    }), 200
 
 #Obtener personajes
-@app.route('/characters', methods=['GET'])
+@api.route('/characters', methods=['GET'])
+@conditional('character')
 def get_all_characters():
-    try:
-        characters=Character.query.all()
-        if len(characters)<1:
-            return jsonify({"msg":"not found"}),404
-        serialized_users=list(map(lambda x: x.serialize(),characters))
-        return serialized_users, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    if "ids" in request.args:
+        return multi_get_response(Character)
+    characters, next_url=keyset_page(db.session, Character)
+    if len(characters)<1 and request.args.get("after") is None and not is_filtered():
+        raise NotFoundError("not found")
+    return paginated_response(characters, next_url), 200
     
 #Obtener personajes por ID
-@app.route('/characters/<int:character_id>', methods=['GET'])
+@api.route('/characters/<int:character_id>', methods=['GET'])
+@conditional('character')
 def get_one_character(character_id):
-    try:
-        character=Character.query.get(character_id)
-        if character is None:
-            return jsonify({"msg":f"user {character_id} not found"}), 404
-        serialized_character=character.serialize()
-        return serialized_character, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    serialized_character=get_serialized(Character, character_id)
+    if serialized_character is None:
+        raise NotFoundError(f"character {character_id} not found")
+    return json_response(serialized_character), 200
     
     
 #Obtener planetas
-@app.route('/planets', methods=['GET'])
+@api.route('/planets', methods=['GET'])
+@conditional('planet')
 def get_all_planets():
-    try:
-        planets=Planet.query.all()
-        if len(planets)<1:
-            return jsonify({"msg":"not found"}),404
-        serialized_users=list(map(lambda x: x.serialize(),planets))
-        return serialized_users, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    if "ids" in request.args:
+        return multi_get_response(Planet)
+    planets, next_url=keyset_page(db.session, Planet)
+    if len(planets)<1 and request.args.get("after") is None and not is_filtered():
+        raise NotFoundError("not found")
+    return paginated_response(planets, next_url), 200
     
 #Obtener planetas por ID
-@app.route('/planets/<int:planet_id>', methods=['GET'])
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional('planet')
 def get_one_planet(planet_id):
-    try:
-        planet=Planet.query.get(planet_id)
-        if planet is None:
-            return jsonify({"msg":f"user {planet_id} not found"}), 404
-        serialized_planet=planet.serialize()
-        return serialized_planet, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    serialized_planet=get_serialized(Planet, planet_id)
+    if serialized_planet is None:
+        raise NotFoundError(f"planet {planet_id} not found")
+    return json_response(serialized_planet), 200
 
 #Obtener starships
-@app.route('/vehicles', methods=['GET'])
+@api.route('/vehicles', methods=['GET'])
+@conditional('vehicle')
 def get_all_vehicles():
-    try:
-        vehicles=Vehicle.query.all()
-        if len(vehicles)<1:
-            return jsonify({"msg":"not found"}),404
-        serialized_users=list(map(lambda x: x.serialize(),vehicles))
-        return serialized_users, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    if "ids" in request.args:
+        return multi_get_response(Vehicle)
+    vehicles, next_url=keyset_page(db.session, Vehicle)
+    if len(vehicles)<1 and request.args.get("after") is None and not is_filtered():
+        raise NotFoundError("not found")
+    return paginated_response(vehicles, next_url), 200
 
 #Obtener starships por ID
-@app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
+@api.route('/vehicles/<int:vehicle_id>', methods=['GET'])
+@conditional('vehicle')
 def get_one_vehicle(vehicle_id):
-    try:
-        vehicle=Vehicle.query.get(vehicle_id)
-        if vehicle is None:
-            return jsonify({"msg":f"user {vehicle_id} not found"}), 404
-        serialized_vehiclet=vehicle.serialize()
-        return serialized_vehiclet, 200
-    except Exception as e:
-        return jsonify({"msg":"Server error", "error":str(e)}), 500
+    serialized_vehicle=get_serialized(Vehicle, vehicle_id)
+    if serialized_vehicle is None:
+        raise NotFoundError(f"vehicle {vehicle_id} not found")
+    return json_response(serialized_vehicle), 200
     
 
+#Planetas, personajes y vehiculos mezclados en una sola llamada: /batch?refs=planet:1,character:4,vehicle:2
+@api.route('/batch', methods=['GET'])
+@conditional('planet', 'character', 'vehicle')
+def get_batch():
+    refs = []
+    for ref in request.args.get("refs", "").split(","):
+        type_name, _, ref_id = ref.strip().partition(":")
+        type_name = type_name[:-1] if type_name.endswith("s") else type_name
+        if type_name not in FAVORITE_TYPES or not ref_id.isdigit():
+            raise ValidationError("refs must be a comma separated list of type:id, with type planet, character or vehicle",
+                                  payload={"ref": ref})
+        refs.append((type_name, int(ref_id)))
+    refs = list(dict.fromkeys(refs))
+    if len(refs) > MAX_PAGE_SIZE:
+        raise ValidationError(f"refs can have at most {MAX_PAGE_SIZE} references")
+    # un IN por tipo
+    found = {}
+    for type_name in FAVORITE_TYPES:
+        ids = [ref_id for t, ref_id in refs if t == type_name]
+        if ids:
+            found[type_name] = get_serialized_many(FAVORITE_TYPES[type_name], ids)
+    return json_response({
+        "results": [{"type": t, "id": i, "data": found[t][i]} for t, i in refs if i in found[t]],
+        "missing": [{"type": t, "id": i} for t, i in refs if i not in found[t]]
+    }), 200
+
+MAX_SEARCH_RESULTS = 100
+
+#Buscar planetas, personajes y vehiculos por nombre y descripcion
+@api.route('/search', methods=['GET'])
+@rate_limit(EXPENSIVE_LIMIT)
+@conditional('planet', 'character', 'vehicle')
+def search_catalog():
+    q = request.args.get("q", "")
+    if not search_terms(q):
+        raise ValidationError("q must contain at least one word")
+    types = [t for t in request.args.get("type", ",".join(SEARCHABLE)).split(",") if t]
+    unknown = [t for t in types if t not in SEARCHABLE]
+    if unknown or not types:
+        raise ValidationError(f"unknown type {', '.join(unknown)}", payload={"allowed": list(SEARCHABLE)})
+    try:
+        limit = int(request.args.get("limit", 20))
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        raise ValidationError("limit and page must be integers")
+    if limit < 1 or limit > MAX_SEARCH_RESULTS or page < 1:
+        raise ValidationError(f"limit must be between 1 and {MAX_SEARCH_RESULTS} and page at least 1")
+    # una fila de mas para saber si hay otra pagina
+    rows = search(db.session, q, types, limit + 1, (page - 1) * limit)
+    results = [{"type": t, "id": i, "name": name, "rank": round(rank, 6)} for t, i, name, rank in rows[:limit]]
+    next_url = None
+    if len(rows) > limit:
+        next_url = url_for(".search_catalog", **{**request.args.to_dict(), "page": page + 1})
+    return json_response({"results": results, "page": page, "next": next_url}), 200
+
+MAX_TOP_FAVORITES = 100
+
+#Planetas, personajes y vehiculos con mas favoritos
+@api.route('/favorites/top', methods=['GET'])
+@conditional('favorite')
+def get_top_favorites():
+    types = [t for t in request.args.get("type", ",".join(CATALOG_MODELS)).split(",") if t]
+    unknown = [t for t in types if t not in CATALOG_MODELS]
+    if unknown or not types:
+        raise ValidationError(f"unknown type {', '.join(unknown)}", payload={"allowed": list(CATALOG_MODELS)})
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        raise ValidationError("limit must be an integer")
+    if limit < 1 or limit > MAX_TOP_FAVORITES:
+        raise ValidationError(f"limit must be between 1 and {MAX_TOP_FAVORITES}")
+    return jsonify({t: top_favorited(db.session, CATALOG_MODELS[t], limit) for t in types}), 200
+
+#Cuantos usuarios tienen en favoritos cada id pedido (?ids=1,2,3), para mostrar en una pagina de la lista
+@api.route('/favorites/counts/<model_name>', methods=['GET'])
+@conditional('favorite')
+def get_favorite_counts(model_name):
+    model = CATALOG_MODELS.get(model_name)
+    if model is None:
+        raise NotFoundError(f"unknown model {model_name}", payload={"allowed": list(CATALOG_MODELS)})
+    ids = parse_ids(request.args.get("ids", ""))
+    counts = favorite_counts(db.session, model, ids)
+    return jsonify({str(i): counts[i] for i in sorted(counts)}), 200
 
+#Exportar una tabla completa del catalogo (planets, characters o vehicles)
+@api.route('/export/<model_name>', methods=['GET'])
+@rate_limit(EXPENSIVE_LIMIT)
+def export_catalog(model_name):
+    model = CATALOG_MODELS.get(model_name)
+    if model is None:
+        raise NotFoundError(f"unknown model {model_name}", payload={"allowed": list(CATALOG_MODELS)})
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "json"):
+        raise ValidationError("format must be ndjson or json")
+    fields = parse_fields(model)
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return Response(stream_with_context(stream_rows(db.session, model, fields, fmt)), mimetype=mimetype)
 
                                                              #POST FAVORITOS
-@app.route('/favorite/planets/<int:user_id>/<int:planet_id>', methods=['POST'])
+def favorite_type(name):
+    # /me/favorites/planets/1 y /me/favorites/planet/1 son lo mismo
+    type_name = name[:-1] if name.endswith("s") else name
+    if type_name not in FAVORITE_TYPES:
+        raise NotFoundError(f"unknown favorite type {name}, use planets, characters or vehicles")
+    return type_name
+
+def add_favorite_response(user_id, type_name, ref_id):
+    # un solo INSERT ... ON CONFLICT DO NOTHING, ver favorites.py
+    label = type_name.capitalize()
+    result = add_favorite(db.session, user_id, type_name, ref_id)
+    db.session.commit()
+    if result == NOT_FOUND:
+        raise NotFoundError(f"{label} not found")
+    if result == USER_NOT_FOUND:
+        raise NotFoundError(f"User {user_id} not found")
+    if result == EXISTS:
+        return jsonify({"msg": f"{label} is already in favorites"}), 200
+    return jsonify({"msg": f"{label} added to favorites"}), 201
+
+@api.route('/favorite/planets/<int:user_id>/<int:planet_id>', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
+@idempotent
 def add_favorite_planet(user_id, planet_id):
-    try:
-        planet = Planet.query.get(planet_id) 
-        if planet is None: 
-            return jsonify({"msg": "Planet not found"}), 404
-        user = User.query.get(user_id) 
-        if user is None: 
-            return jsonify({"msg": f"User {user_id} not found"}), 404
-        new_favorite = Favorite( user_id=user_id, planet_id=planet_id )
-        db.session.add(new_favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Planet added to favorites"}), 201 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
-    
-@app.route('/favorite/characters/<int:user_id>/<int:character_id>', methods=['POST'])
+    return add_favorite_response(user_id, "planet", planet_id)
+
+@api.route('/favorite/characters/<int:user_id>/<int:character_id>', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
+@idempotent
 def add_favorite_character(user_id, character_id):
-    try:
-        character = Character.query.get(character_id) 
-        if character is None: 
-            return jsonify({"msg": "Character not found"}), 404
-        user = User.query.get(user_id) 
-        if user is None: 
-            return jsonify({"msg": f"User {user_id} not found"}), 404
-        new_favorite = Favorite( user_id=user_id, character_id=character_id )
-        db.session.add(new_favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Character added to favorites"}), 201 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
-    
-@app.route('/favorite/vehicles/<int:user_id>/<int:vehicle_id>', methods=['POST'])    
+    return add_favorite_response(user_id, "character", character_id)
+
+@api.route('/favorite/vehicles/<int:user_id>/<int:vehicle_id>', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
+@idempotent
 def add_favorite_vehicle(user_id, vehicle_id):
-    try:
-        vehicle = Vehicle.query.get(vehicle_id) 
-        if vehicle is None: 
-            return jsonify({"msg": "Vehicle not found"}), 404
-        user = User.query.get(user_id) 
-        if user is None: 
-            return jsonify({"msg": f"User {user_id} not found"}), 404
-        new_favorite = Favorite( user_id=user_id, vehicle_id=vehicle_id )
-        db.session.add(new_favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Vehicle added to favorites"}), 201 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
-    
+    return add_favorite_response(user_id, "vehicle", vehicle_id)
+
+@api.route('/me/favorites/<type_name>/<int:ref_id>', methods=['POST'])
+@rate_limit(WRITE_LIMIT)
+@login_required
+@idempotent
+def add_my_favorite(type_name, ref_id):
+    return add_favorite_response(current_user_id(), favorite_type(type_name), ref_id)
+
 
 
 
                                                             #Delete de Favoritos
-@app.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['DELETE'])
+def remove_favorite_response(user_id, type_name, ref_id):
+    removed = remove_favorite(db.session, user_id, type_name, ref_id)
+    db.session.commit()
+    if not removed:
+        raise NotFoundError(f"Favorite {type_name} not found")
+    return jsonify({"msg": f"Favorite {type_name} deleted"}), 200
+
+@api.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['DELETE'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
 def delete_favorite_planet(user_id, planet_id):
-    try:
-        favorite = Favorite.query.filter_by(user_id=user_id, planet_id=planet_id).first()     
-        if favorite is None:   
-            return jsonify({"msg": "Favorite planet not found"}), 404
-        db.session.delete(favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Favorite planet deleted"}), 200 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
+    return remove_favorite_response(user_id, "planet", planet_id)
 
-@app.route('/favorite/characters/<int:user_id>/<int:character_id>', methods=['DELETE'])
+@api.route('/favorite/characters/<int:user_id>/<int:character_id>', methods=['DELETE'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
 def delete_favorite_character(user_id, character_id):
-    try:
-        favorite = Favorite.query.filter_by(user_id=user_id, character_id=character_id).first()     
-        if favorite is None:   
-            return jsonify({"msg": "Favorite character not found"}), 404
-        db.session.delete(favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Favorite character deleted"}), 200 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
-    
-@app.route('/favorite/vehicles/<int:user_id>/<int:vehicle_id>', methods=['DELETE'])
+    return remove_favorite_response(user_id, "character", character_id)
+
+@api.route('/favorite/vehicles/<int:user_id>/<int:vehicle_id>', methods=['DELETE'])
+@rate_limit(WRITE_LIMIT)
+@owner_required
 def delete_favorite_vehicle(user_id, vehicle_id):
-    try:
-        favorite = Favorite.query.filter_by(user_id=user_id, vehicle_id=vehicle_id).first()     
-        if favorite is None:   
-            return jsonify({"msg": "Favorite vehicle not found"}), 404
-        db.session.delete(favorite) 
-        db.session.commit()
-        return jsonify({"msg": "Favorite vehicle deleted"}), 200 
-    except Exception as e: 
-        return jsonify({"msg": "Server error", "error": str(e)}), 500
-    
+    return remove_favorite_response(user_id, "vehicle", vehicle_id)
+
+@api.route('/me/favorites/<type_name>/<int:ref_id>', methods=['DELETE'])
+@rate_limit(WRITE_LIMIT)
+@login_required
+def delete_my_favorite(type_name, ref_id):
+    return remove_favorite_response(current_user_id(), favorite_type(type_name), ref_id)
+
+
+# Flask-Admin en /admin, solo si se pide: los workers de la API no lo cargan
+ENABLE_ADMIN = os.getenv("ENABLE_ADMIN", "false").lower() in ("1", "true", "yes")
+
+
+def create_app():
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+
+    configure_database(app)
+    # Handle/serialize errors like a JSON object
+    setup_error_handlers(app)
+
+    db.init_app(app)
+    CORS(app)
+    setup_commands(app)
+    setup_instrumentation(app)
+    setup_rate_limit(app)
+    setup_conditional(app)
+    setup_compression(app)
+    app.register_blueprint(api)
+
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        # flask db ... needs it, the web workers never do
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if ENABLE_ADMIN:
+        from admin import setup_admin
+        setup_admin(app)
+    return app
+
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
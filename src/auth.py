@@ -0,0 +1,170 @@
+"""
+Bearer token authentication.
+
+POST /login returns a token signed with HMAC SHA-256 (itsdangerous) holding the
+user id and a random token id (jti); clients send it back as
+"Authorization: Bearer <token>". Checking a token needs no database:
+
+- verified tokens are kept in a small cache per worker, a repeated token costs a
+  dict lookup instead of the signature check;
+- revocations (POST /logout, a deactivated user) are rows of revoked_token that
+  each worker reads into memory at most every AUTH_REVOCATION_REFRESH seconds,
+  only the rows added since its last read. A revoked token can be accepted by
+  other workers for that long.
+
+    AUTH_SECRET_KEY          signing key, FLASK_APP_KEY when not set
+    AUTH_TOKEN_TTL           seconds a token is valid (86400)
+    AUTH_CACHE_SIZE          verified tokens kept per worker (10000)
+    AUTH_REVOCATION_REFRESH  seconds between reads of revoked_token (5)
+"""
+import hashlib
+import os
+import secrets
+import threading
+import time
+from functools import wraps
+from flask import g, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import select, delete
+from cache import TTLCache
+from models import db, RevokedToken
+from utils import UnauthorizedError, ForbiddenError
+
+TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", 86400))
+REVOCATION_REFRESH = float(os.getenv("AUTH_REVOCATION_REFRESH", 5))
+
+_serializer = URLSafeTimedSerializer(
+    os.getenv("AUTH_SECRET_KEY") or os.getenv("FLASK_APP_KEY", "sample key"),
+    salt="auth-token", signer_kwargs={"digest_method": hashlib.sha256}
+)
+# token -> (user id, jti, issued at), the expiration is checked on every use
+_verified = TTLCache(maxsize=int(os.getenv("AUTH_CACHE_SIZE", 10000)), ttl=300)
+
+
+class _Revocations:
+    """The revoked_token rows of this worker, refreshed from the primary database"""
+
+    def __init__(self):
+        self.jtis = set()
+        self.users = {}  # user id -> tokens issued up to this time are revoked
+        self.last_id = 0
+        self.next_refresh = 0
+        self.next_reload = 0
+        self._lock = threading.Lock()
+
+    def add(self, jti, user_id, revoked_at, jtis=None, users=None):
+        jtis = self.jtis if jtis is None else jtis
+        users = self.users if users is None else users
+        if jti is not None:
+            jtis.add(jti)
+        else:
+            users[user_id] = max(revoked_at, users.get(user_id, 0))
+
+    def refresh(self):
+        now = time.monotonic()
+        # one thread reads, the others go on with what is already loaded
+        if now < self.next_refresh or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.next_refresh = now + REVOCATION_REFRESH
+            # start over once in a while so the revocations of expired tokens leave memory,
+            # the new sets replace the old ones only once they are complete
+            reload = now >= self.next_reload
+            last_id = 0 if reload else self.last_id
+            # the engine and not db.session: GET requests read from the replica, which may lag behind
+            with db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(RevokedToken.id, RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_at)
+                    .where(RevokedToken.id > last_id, RevokedToken.expires_at > time.time())
+                    .order_by(RevokedToken.id)
+                ).all()
+            jtis, users = (set(), {}) if reload else (self.jtis, self.users)
+            for row in rows:
+                self.add(row.jti, row.user_id, row.revoked_at, jtis, users)
+                last_id = row.id
+            if reload:
+                self.jtis, self.users = jtis, users
+                self.next_reload = now + TOKEN_TTL
+            self.last_id = last_id
+        finally:
+            self._lock.release()
+
+    def is_revoked(self, user_id, jti, issued_at):
+        return jti in self.jtis or issued_at <= self.users.get(user_id, -1)
+
+
+revocations = _Revocations()
+
+
+def issue_token(user_id):
+    """(token, seconds until it expires)"""
+    return _serializer.dumps({"u": user_id, "j": secrets.token_hex(8)}), TOKEN_TTL
+
+
+def _verify(token):
+    claims = _verified.get(token)
+    if claims is None:
+        try:
+            payload, issued_at = _serializer.loads(token, max_age=TOKEN_TTL, return_timestamp=True)
+        except BadSignature:
+            return None
+        claims = (payload["u"], payload["j"], issued_at.timestamp())
+        _verified.set(token, claims)
+    elif claims[2] + TOKEN_TTL < time.time():
+        return None
+    revocations.refresh()
+    if revocations.is_revoked(*claims):
+        return None
+    return claims
+
+
+def authenticated_user_id():
+    """Id of the user of the bearer token of the request, None without a valid one"""
+    if "auth" not in g:
+        header = request.headers.get("Authorization", "")
+        scheme, _, token = header.partition(" ")
+        g.auth = _verify(token.strip()) if scheme.lower() == "bearer" and token else None
+    return g.auth[0] if g.auth else None
+
+
+def current_user_id():
+    user_id = authenticated_user_id()
+    if user_id is None:
+        raise UnauthorizedError("a valid bearer token is required")
+    return user_id
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        current_user_id()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def owner_required(view):
+    """For the /user/<user_id>/... routes, only the user of the token can use them"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user_id() != kwargs["user_id"]:
+            raise ForbiddenError("the token belongs to another user")
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def revoke_current_token(session):
+    user_id, jti, issued_at = g.auth
+    session.add(RevokedToken(jti=jti, user_id=user_id, revoked_at=time.time(), expires_at=issued_at + TOKEN_TTL))
+    revocations.add(jti, user_id, None)
+
+
+def revoke_user_tokens(session, user_id):
+    """Every token issued to the user until now stops working, e.g. when the user is deactivated"""
+    now = time.time()
+    session.add(RevokedToken(jti=None, user_id=user_id, revoked_at=now, expires_at=now + TOKEN_TTL))
+    revocations.add(None, user_id, now)
+
+
+def prune_revocations(connection):
+    """Deletes the rows of tokens that expired anyway, returns how many"""
+    return connection.execute(delete(RevokedToken).where(RevokedToken.expires_at <= time.time())).rowcount
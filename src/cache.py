@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Planet, Character, Vehicle
+from serializers import row_serializer, select_by_id
+from utils import serialized_fields
+
+CACHED_MODELS = (Planet, Character, Vehicle)
+
+
+class TTLCache:
+    """
+    Small thread safe LRU cache where every entry also expires after `ttl` seconds.
+    Each gunicorn worker has its own copy, the ttl bounds how long a worker can
+    serve an entry that was changed by another worker.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None
+        }
+
+
+entity_cache = TTLCache(
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", 300))
+)
+
+
+def get_serialized(model, entity_id):
+    """Returns model.serialize() for the row with that id, or None if it does not exist"""
+    key = (model.__tablename__, entity_id)
+    serialized = entity_cache.get(key)
+    if serialized is None:
+        # plain column tuple instead of an ORM instance, same dict as entity.serialize()
+        fields = serialized_fields(model)
+        row = db.session.execute(select_by_id(model, fields), {"entity_id": entity_id}).first()
+        if row is None:
+            return None
+        serialized = row_serializer(fields)(row)
+        entity_cache.set(key, serialized)
+    return serialized
+
+
+# ids per IN query, SQLite before 3.32 accepts at most 999 parameters per statement
+MAX_IN_IDS = 500
+
+
+def get_serialized_many(model, ids):
+    """
+    {id: model.serialize()} for the ids that exist. Ids in the cache cost no
+    query, the others are read with one IN query (per MAX_IN_IDS ids).
+    """
+    table = model.__tablename__
+    found = {}
+    missing = []
+    for entity_id in ids:
+        serialized = entity_cache.get((table, entity_id))
+        if serialized is None:
+            missing.append(entity_id)
+        else:
+            found[entity_id] = serialized
+    if missing:
+        fields = serialized_fields(model)
+        to_dict = row_serializer(fields)
+        columns = [getattr(model, f) for f in fields]
+        for start in range(0, len(missing), MAX_IN_IDS):
+            chunk = missing[start:start + MAX_IN_IDS]
+            for row in db.session.execute(select(*columns).where(model.id.in_(chunk))):
+                serialized = to_dict(row)
+                entity_cache.set((table, serialized["id"]), serialized)
+                found[serialized["id"]] = serialized
+    return found
+
+
+def invalidate(model, entity_id):
+    entity_cache.delete((model.__tablename__, entity_id))
+
+
+# In-process version of every table, bumped on each committed write. Used by
+# conditional.py to know that a response it already hashed is still current.
+table_versions = {}
+_versions_lock = threading.Lock()
+
+
+def table_version(tablename):
+    return table_versions.get(tablename, 0)
+
+
+def mark_changed(tablename):
+    with _versions_lock:
+        table_versions[tablename] = table_versions.get(tablename, 0) + 1
+
+
+def changed_on_commit(session, *tablenames):
+    """For writes made with Core statements, which the flush listener below does not see"""
+    session.info.setdefault("changed_tables", set()).update(tablenames)
+
+
+# Any write that goes through a session (our routes, Flask-Admin, scripts) is
+# collected at flush time and evicted once the transaction is committed.
+@event.listens_for(Session, "after_flush")
+def _collect_changed_entities(session, flush_context):
+    changed = session.info.setdefault("changed_entities", set())
+    tables = session.info.setdefault("changed_tables", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tables.add(obj.__tablename__)
+        if isinstance(obj, CACHED_MODELS) and obj.id is not None:
+            changed.add((obj.__tablename__, obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_entities(session):
+    for key in session.info.pop("changed_entities", ()):
+        entity_cache.delete(key)
+    for tablename in session.info.pop("changed_tables", ()):
+        mark_changed(tablename)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed_entities(session, previous_transaction):
+    session.info.pop("changed_entities", None)
+    session.info.pop("changed_tables", None)
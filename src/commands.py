@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+import os
+import time
+import click
+from sqlalchemy import Integer, Float, insert, text
+from sqlalchemy.exc import IntegrityError
+from models import db, User, CATALOG_MODELS
+from search import rebuild_index, SEARCHABLE
+from counters import recount_favorites
+from credentials import hash_password, is_hashed
+from auth import prune_revocations
+
+
+def read_records(path, fmt):
+    """Yields one dict per row of a CSV, NDJSON or JSON array file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        elif fmt == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def make_coercer(table):
+    """Converts the values of a record (strings when they come from a CSV) to the column types"""
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, Integer):
+            converters[column.name] = int
+        elif isinstance(column.type, Float):
+            converters[column.name] = float
+        else:
+            converters[column.name] = str
+    required = [c.name for c in table.columns if not c.nullable and not c.primary_key and c.server_default is None]
+
+    def coerce(record, columns):
+        row = {}
+        for name in columns:
+            value = record.get(name)
+            if value is None or (value == "" and converters[name] is not str):
+                row[name] = None
+            else:
+                row[name] = converters[name](value)
+        missing = [name for name in required if row.get(name) is None]
+        if missing:
+            raise click.ClickException(f"record {record!r} is missing {', '.join(missing)}")
+        return row
+    return coerce
+
+
+def upsert_statement(table, dialect, columns, key="name"):
+    """INSERT that updates the existing row when the key (name, or id with --keep-ids) is already taken"""
+    updates = [c for c in columns if c not in ("id", key)]
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(table)
+        return stmt.on_conflict_do_update(index_elements=[key], set_={c: stmt.excluded[c] for c in updates})
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table)
+        return stmt.on_conflict_do_update(index_elements=[key], set_={c: stmt.excluded[c] for c in updates})
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in updates})
+    raise click.ClickException(f"--upsert is not supported on {dialect}")
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(connection, table, columns, rows):
+    """Loads rows with PostgreSQL COPY, much faster than INSERT when no upsert is needed"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[c]) for c in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f'COPY "{table.name}" ({", ".join(columns)}) FROM STDIN', buffer)
+    cursor.close()
+
+
+def reset_id_sequence(connection, table):
+    """Moves the PostgreSQL id sequence past the ids loaded explicitly, the next INSERT would reuse them"""
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) "
+        f'FROM "{table.name}"'
+    ), {"table": f'"{table.name}"'})
+
+
+def setup_commands(app):
+
+    @app.cli.command("import-catalog")
+    @click.argument("model_name", type=click.Choice(list(CATALOG_MODELS)))
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["csv", "json", "ndjson"]), default=None,
+                  help="File format, guessed from the extension by default.")
+    @click.option("--batch-size", default=5000, show_default=True, help="Rows sent per statement and committed together.")
+    @click.option("--upsert/--no-upsert", default=True, show_default=True,
+                  help="Update the rows whose name already exists instead of failing.")
+    @click.option("--keep-ids/--no-keep-ids", default=False, show_default=True,
+                  help="Load the id column of the file (e.g. from /export) instead of letting the database number "
+                       "the rows. With --upsert the rows are then matched by id instead of by name.")
+    def import_catalog(model_name, path, fmt, batch_size, upsert, keep_ids):
+        """Bulk loads planets, characters or vehicles from a CSV, JSON or NDJSON file."""
+        table = CATALOG_MODELS[model_name].__table__
+        fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in ("csv", "json", "ndjson"):
+            raise click.ClickException("could not guess the format, use --format")
+        dialect = db.engine.dialect.name
+        use_copy = dialect == "postgresql" and not upsert
+
+        records = read_records(path, fmt)
+        first = next(records, None)
+        if first is None:
+            click.echo("nothing to import")
+            return
+        # the columns of the first record decide what is loaded, id only with --keep-ids
+        columns = [c.name for c in table.columns if c.name in first and (keep_ids or c.name != "id")]
+        keep_ids = "id" in columns
+        coerce = make_coercer(table)
+        stmt = upsert_statement(table, dialect, columns, "id" if keep_ids else "name") if upsert else insert(table)
+
+        def load(connection, rows):
+            try:
+                if use_copy:
+                    copy_rows(connection, table, columns, rows)
+                else:
+                    connection.execute(stmt, rows)
+            except (IntegrityError, db.engine.dialect.dbapi.IntegrityError) as error:
+                # the batches before this one are committed, say so instead of a traceback
+                raise click.ClickException(f"a row conflicts with the {model_name} in the database after {total} "
+                                           f"rows were imported, nothing of the failing batch was saved: "
+                                           f"{getattr(error, 'orig', error)}")
+            if keep_ids and dialect == "postgresql":
+                reset_id_sequence(connection, table)
+
+        total = 0
+        start = time.perf_counter()
+        batch = [coerce(first, columns)]
+        for record in records:
+            batch.append(coerce(record, columns))
+            if len(batch) >= batch_size:
+                with db.engine.begin() as connection:
+                    load(connection, batch)
+                total += len(batch)
+                batch = []
+                elapsed = time.perf_counter() - start
+                click.echo(f"{total} rows ({total / elapsed:,.0f} rows/s)")
+        if batch:
+            with db.engine.begin() as connection:
+                load(connection, batch)
+            total += len(batch)
+        elapsed = time.perf_counter() - start
+        click.echo(f"imported {total} {model_name} in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+        # Core inserts skip the mapper events that keep the SQLite search index in sync
+        with db.engine.begin() as connection:
+            rebuild_index(connection, model_name)
+
+    @app.cli.command("search-reindex")
+    @click.argument("model_names", nargs=-1, type=click.Choice(list(SEARCHABLE)))
+    def search_reindex(model_names):
+        """Rebuilds the SQLite full text search index (PostgreSQL keeps its own up to date)."""
+        for model_name in model_names or SEARCHABLE:
+            start = time.perf_counter()
+            with db.engine.begin() as connection:
+                rebuild_index(connection, model_name)
+            click.echo(f"reindexed {model_name} in {time.perf_counter() - start:.2f}s")
+
+    @app.cli.command("favorites-recount")
+    def favorites_recount():
+        """Recomputes the favorite counters, after favorites were written without the ORM."""
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            recount_favorites(connection)
+        click.echo(f"recounted favorites in {time.perf_counter() - start:.2f}s")
+
+    @app.cli.command("passwords-hash")
+    def passwords_hash():
+        """Hashes the passwords still stored in plaintext, the logins upgrade them one by one otherwise."""
+        start = time.perf_counter()
+        rows = [(user_id, password) for user_id, password in db.session.query(User.id, User.password)
+                if not is_hashed(password)]
+        for user_id, password in rows:
+            db.session.query(User).filter_by(id=user_id, password=password).update({"password": hash_password(password)})
+            db.session.commit()
+        click.echo(f"hashed {len(rows)} passwords in {time.perf_counter() - start:.2f}s")
+
+    @app.cli.command("tokens-prune")
+    def tokens_prune():
+        """Deletes the revocations of tokens that have expired anyway."""
+        with db.engine.begin() as connection:
+            removed = prune_revocations(connection)
+        click.echo(f"deleted {removed} expired revocations")
@@ -0,0 +1,73 @@
+"""
+gzip and brotli compression of responses, negotiated with Accept-Encoding.
+
+Only bodies of at least COMPRESS_MIN_SIZE bytes with a compressible mimetype
+are compressed; streamed responses (/export) are sent as they are. Responses
+that carry an ETag (the conditional GET routes) are compressed once and kept
+in a cache keyed by that ETag and encoding, so hot pages that did not change
+cost a lookup. As nginx does, the ETag of a compressed response becomes weak,
+it names the same content in another encoding.
+
+    COMPRESS_MIN_SIZE     smallest body worth compressing, in bytes (1024)
+    COMPRESS_LEVEL        gzip level, 1-9 (6)
+    COMPRESS_BR_QUALITY   brotli quality, 0-11 (5)
+    COMPRESS_CACHE_SIZE   compressed bodies kept per worker (512)
+
+brotli is optional, without it only gzip is offered.
+"""
+import gzip
+import os
+from flask import request
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BR_QUALITY", 5))
+COMPRESSIBLE = {"application/json", "application/msgpack", "application/x-ndjson", "text/html", "text/plain",
+                "text/css", "application/javascript"}
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+compressed_cache = TTLCache(maxsize=int(os.getenv("COMPRESS_CACHE_SIZE", 512)), ttl=3600)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output of the same body identical
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE or "Content-Encoding" in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    etag, _ = response.get_etag()
+    if etag is None:
+        body = compress(data, encoding)
+    else:
+        key = (etag, encoding)
+        body = compressed_cache.get(key)
+        if body is None:
+            body = compress(data, encoding)
+            compressed_cache.set(key, body)
+        response.set_etag(etag, weak=True)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def setup_compression(app):
+    app.after_request(_compress_response)
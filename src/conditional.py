@@ -0,0 +1,75 @@
+import os
+from functools import wraps
+from flask import g, request, make_response
+from cache import TTLCache, table_version
+from serializers import wants_msgpack
+from compression import ENCODINGS
+
+# How long a worker trusts its own table versions to answer 304 without running
+# the view. Writes made by other workers are only seen once this expires, so
+# private views (the data of one user) never take this shortcut.
+SNAPSHOT_TTL = float(os.getenv("ETAG_SNAPSHOT_TTL", 30))
+PUBLIC_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", 0))
+
+# (path, authorization, msgpack, content coding) -> (table versions, etag, weak, vary) of the last 200 we sent,
+# read once compression has run so a 304 repeats the validators of that 200
+_validated = TTLCache(maxsize=int(os.getenv("ETAG_SNAPSHOT_SIZE", 8192)), ttl=SNAPSHOT_TTL)
+
+
+def _cache_control(private):
+    if private:
+        return "private, no-cache"
+    if PUBLIC_MAX_AGE > 0:
+        return f"public, max-age={PUBLIC_MAX_AGE}"
+    return "public, no-cache"
+
+
+def conditional(*tables, private=False):
+    """
+    Adds a strong ETag (hash of the body) and Cache-Control to the GET responses
+    of a view, answers 304 Not Modified when If-None-Match matches, and skips
+    the view entirely when none of `tables` changed since that ETag was computed.
+    If-None-Match uses the weak comparison, compressed responses carry a weak ETag.
+    Private views always run, a user must see their own writes whatever worker made them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.full_path, request.headers.get("Authorization"), wants_msgpack(),
+                   request.accept_encodings.best_match(ENCODINGS))
+            versions = tuple(table_version(t) for t in tables)
+            if request.if_none_match and not private:
+                known = _validated.get(key)
+                if known is not None and known[0] == versions and request.if_none_match.contains_weak(known[1]):
+                    response = make_response("", 304)
+                    response.set_etag(known[1], weak=known[2])
+                    response.vary.update(known[3])
+                    response.headers["Cache-Control"] = _cache_control(private)
+                    return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            response.add_etag()
+            response.headers["Cache-Control"] = _cache_control(private)
+            # the 304 check waits for _finish_conditional, after compression set the final ETag and Vary
+            g.conditional = (None if private else key, versions)
+            return response
+        return wrapper
+    return decorator
+
+
+def _finish_conditional(response):
+    state = g.pop("conditional", None)
+    if state is None or response.status_code != 200:
+        return response
+    key, versions = state
+    if key is not None:
+        etag, weak = response.get_etag()
+        _validated.set(key, (versions, etag, weak, tuple(response.vary)))
+    return response.make_conditional(request)
+
+
+def setup_conditional(app):
+    # after_request functions run in reverse order: register this before setup_compression
+    app.after_request(_finish_conditional)
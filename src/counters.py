@@ -0,0 +1,119 @@
+"""
+Denormalized favorite counters.
+
+planet, character and vehicle have a favorite_count column and user has one
+count per favorite type, so "favorited by N users" and the per-user summary are
+primary key reads instead of aggregations over the favorite table. They are
+updated inside the same transaction as the favorites themselves: the API
+routes and the batch endpoint write through favorites.py, which applies the
+rows its statements actually changed, and the flush listener below covers ORM
+writes such as the admin. Writes that skip both (bulk Core inserts) must call
+recount_favorites.
+"""
+from collections import Counter
+from sqlalchemy import event, select, update, func, bindparam
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from models import Favorite, User, FAVORITE_TYPES
+
+_tables = {model.__tablename__: model.__table__ for model in [User, *FAVORITE_TYPES.values()]}
+
+
+def user_counter(type_name):
+    """Column of the user table counting the favorites of that type"""
+    return f"favorite_{type_name}_count"
+
+
+def favorite_deltas(session):
+    """(table, column, id) -> change of the counter for the favorites being flushed"""
+    deltas = Counter()
+
+    def count(value, sign):
+        # value(attribute) reads the favorite as it is now or as it was loaded
+        user_id = value("user_id")
+        for type_name, model in FAVORITE_TYPES.items():
+            ref_id = value(f"{type_name}_id")
+            if ref_id is not None:
+                deltas[(model.__tablename__, "favorite_count", ref_id)] += sign
+                deltas[("user", user_counter(type_name), user_id)] += sign
+
+    for obj in session.new:
+        if isinstance(obj, Favorite):
+            count(lambda attribute: getattr(obj, attribute), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Favorite):
+            count(lambda attribute: _committed(obj, attribute), -1)
+    for obj in session.dirty:
+        if isinstance(obj, Favorite) and session.is_modified(obj):
+            count(lambda attribute: _committed(obj, attribute), -1)
+            count(lambda attribute: getattr(obj, attribute), 1)
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def _committed(obj, attribute):
+    history = get_history(obj, attribute)
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else getattr(obj, attribute)
+
+
+def apply_favorite_deltas(connection, deltas):
+    """One executemany UPDATE per counter column"""
+    by_column = {}
+    for (table, column, ref_id), delta in deltas.items():
+        by_column.setdefault((table, column), []).append({"delta": delta, "ref_id": ref_id})
+    for (table, column), params in sorted(by_column.items()):
+        table = _tables[table]
+        connection.execute(
+            update(table).values({column: table.c[column] + bindparam("delta")})
+            .where(table.c.id == bindparam("ref_id")),
+            params
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _update_favorite_counters(session, flush_context):
+    deltas = favorite_deltas(session)
+    if deltas:
+        apply_favorite_deltas(session.connection(), deltas)
+
+
+def recount_favorites(connection):
+    """Recomputes every counter from the favorite table"""
+    favorite, user = Favorite.__table__, User.__table__
+    for type_name, model in FAVORITE_TYPES.items():
+        table = model.__table__
+        reference = favorite.c[f"{type_name}_id"]
+        connection.execute(update(table).values(
+            favorite_count=select(func.count()).where(reference == table.c.id).scalar_subquery()
+        ))
+        connection.execute(update(user).values({user_counter(type_name): select(func.count()).where(
+            favorite.c.user_id == user.c.id, reference.isnot(None)).scalar_subquery()}))
+
+
+def favorite_summary(session, user_id):
+    """Favorite counts of one user by type, None when the user does not exist"""
+    columns = [getattr(User, user_counter(t)) for t in FAVORITE_TYPES]
+    row = session.execute(select(*columns).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    summary = {f"{t}s": count for t, count in zip(FAVORITE_TYPES, row)}
+    summary["total"] = sum(row)
+    return summary
+
+
+def top_favorited(session, model, limit):
+    """The `limit` most favorited rows of model, served by the (favorite_count, id) index"""
+    rows = session.execute(
+        select(model.id, model.name, model.favorite_count)
+        .where(model.favorite_count > 0)
+        .order_by(model.favorite_count.desc(), model.id.desc())
+        .limit(limit)
+    )
+    return [{"id": r.id, "name": r.name, "favorite_count": r.favorite_count} for r in rows]
+
+
+def favorite_counts(session, model, ids):
+    """{id: favorite_count} for the given ids of model, missing ids are left out"""
+    rows = session.execute(select(model.id, model.favorite_count).where(model.id.in_(ids)))
+    return {r.id: r.favorite_count for r in rows}
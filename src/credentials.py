@@ -0,0 +1,185 @@
+"""
+Password hashing.
+
+Passwords are stored as "$scrypt$ln=15,r=8,p=1$<salt>$<hash>" (hashlib, always
+available) or as an argon2id string when PASSWORD_SCHEME=argon2 and argon2-cffi
+is installed:
+
+    PASSWORD_SCHEME         scrypt or argon2 (scrypt)
+    SCRYPT_LOG_N            scrypt cost, N = 2 ** SCRYPT_LOG_N (15)
+    SCRYPT_R, SCRYPT_P      scrypt block size and parallelism (8, 1)
+    ARGON2_TIME_COST        argon2 iterations (3)
+    ARGON2_MEMORY_KIB       argon2 memory (65536)
+    ARGON2_PARALLELISM      argon2 lanes (1)
+    PASSWORD_HASH_THREADS   hashes running at the same time per worker (cpus)
+    PASSWORD_HASH_TIMEOUT   seconds to wait for a free hashing thread before a 503 (5)
+
+Both functions are memory hard on purpose: one scrypt hash with the defaults
+takes tens of milliseconds and 32 MiB (128 * N * r bytes). They release the GIL,
+so they run on a small pool of real threads (the gevent hub threadpool under
+gevent workers) while the other requests of the worker keep being served, and
+the pool bounds the CPU and memory a burst of signups or logins can take.
+
+verify_password also returns a new hash when the stored one was made with other
+settings, or is a plaintext password from before this module, so the login
+upgrades it.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import ValidationError, ServiceUnavailableError
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:  # optional, PASSWORD_SCHEME=argon2 needs argon2-cffi
+    PasswordHasher = None
+
+logger = logging.getLogger(__name__)
+
+MAX_PASSWORD_LENGTH = 1024
+SCRYPT_LOG_N = int(os.getenv("SCRYPT_LOG_N", 15))
+SCRYPT_R = int(os.getenv("SCRYPT_R", 8))
+SCRYPT_P = int(os.getenv("SCRYPT_P", 1))
+HASH_THREADS = int(os.getenv("PASSWORD_HASH_THREADS", os.cpu_count() or 1))
+HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5))
+
+SCHEME = os.getenv("PASSWORD_SCHEME", "scrypt").lower()
+if SCHEME not in ("scrypt", "argon2"):
+    raise ValueError(f"unknown PASSWORD_SCHEME {SCHEME!r}, use scrypt or argon2")
+if SCHEME == "argon2" and PasswordHasher is None:
+    logger.warning("PASSWORD_SCHEME=argon2 but argon2-cffi is not installed, hashing with scrypt")
+    SCHEME = "scrypt"
+
+_argon2 = PasswordHasher(
+    time_cost=int(os.getenv("ARGON2_TIME_COST", 3)),
+    memory_cost=int(os.getenv("ARGON2_MEMORY_KIB", 65536)),
+    parallelism=int(os.getenv("ARGON2_PARALLELISM", 1)),
+) if PasswordHasher is not None else None
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 1 << log_n
+    # OpenSSL refuses to use more than 32 MiB unless told otherwise
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=129 * n * r * p + 2 ** 20, dklen=32)
+
+
+def _hash(password):
+    if SCHEME == "argon2":
+        return _argon2.hash(password)
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+    return f"$scrypt$ln={SCRYPT_LOG_N},r={SCRYPT_R},p={SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def _verify(password, stored):
+    """(matches, needs a new hash)"""
+    if stored.startswith("$scrypt$"):
+        try:
+            _, _, settings, salt, digest = stored.split("$")
+            params = dict(item.split("=") for item in settings.split(","))
+            log_n, r, p = int(params["ln"]), int(params["r"]), int(params["p"])
+        except (ValueError, KeyError):
+            return False, False
+        ok = hmac.compare_digest(_scrypt(password, _unb64(salt), log_n, r, p), _unb64(digest))
+        return ok, SCHEME != "scrypt" or (log_n, r, p) != (SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+    if stored.startswith("$argon2"):
+        if _argon2 is None:
+            logger.error("a password is hashed with argon2 but argon2-cffi is not installed")
+            return False, False
+        try:
+            _argon2.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, SCHEME != "argon2" or _argon2.check_needs_rehash(stored)
+    # plaintext stored before passwords were hashed
+    return hmac.compare_digest(stored.encode(), password.encode()), True
+
+
+def _verify_and_rehash(password, stored):
+    if stored is None:
+        # unknown email: spend the same time as a real check so it can not be told apart
+        _verify(password, _dummy_hash())
+        return False, None
+    ok, outdated = _verify(password, stored)
+    return ok, _hash(password) if ok and outdated else None
+
+
+_dummy = None
+
+
+def _dummy_hash():
+    global _dummy
+    if _dummy is None:
+        _dummy = _hash(secrets.token_hex(16))
+    return _dummy
+
+
+_slots = threading.BoundedSemaphore(HASH_THREADS)
+_executor = None
+_executor_pid = None
+
+
+def _gevent_patched():
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def _run(fn, *args):
+    """Runs fn on the hashing threads, at most HASH_THREADS at a time"""
+    global _executor, _executor_pid
+    if not _slots.acquire(timeout=HASH_TIMEOUT):
+        raise ServiceUnavailableError("Too many password checks in progress, retry later")
+    try:
+        if _gevent_patched():
+            # threading is patched into greenlets there, the hub threadpool uses real threads
+            import gevent
+            return gevent.get_hub().threadpool.apply(fn, args)
+        # threads do not survive a fork, each worker starts its own pool
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HASH_THREADS, thread_name_prefix="password-hash")
+            _executor_pid = os.getpid()
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def validate_password(password):
+    if not isinstance(password, str) or not password:
+        raise ValidationError("password is required")
+    if len(password) > MAX_PASSWORD_LENGTH:
+        # the cost of scrypt grows with the input, do not let anyone send megabytes
+        raise ValidationError(f"password can have at most {MAX_PASSWORD_LENGTH} characters")
+    return password
+
+
+def hash_password(password):
+    """Hash to store in User.password"""
+    return _run(_hash, validate_password(password))
+
+
+def verify_password(password, stored):
+    """
+    (matches, new hash or None). stored is None when the user does not exist,
+    the check still takes as long. A new hash is returned when the password
+    matches a hash made with other settings, store it in place of the old one.
+    """
+    return _run(_verify_and_rehash, validate_password(password), stored)
+
+
+def is_hashed(stored):
+    return stored.startswith(("$scrypt$", "$argon2"))
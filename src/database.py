@@ -0,0 +1,94 @@
+"""
+Database configuration from environment variables.
+
+    DATABASE_URL              primary database (sqlite:////tmp/test.db when missing)
+    DATABASE_REPLICA_URL      optional read replica, used by GET/HEAD requests
+    DB_POOL_SIZE              connections kept open per worker (5)
+    DB_MAX_OVERFLOW           extra connections allowed under bursts (10)
+    DB_POOL_TIMEOUT           seconds to wait for a free connection before failing (30)
+    DB_POOL_RECYCLE           seconds after which a connection is replaced (1800)
+    DB_POOL_PRE_PING          test connections before using them, true/false (true)
+    DB_STATEMENT_TIMEOUT_MS   cancel statements running longer than this, 0 disables (0)
+
+The pool settings apply to every engine except SQLite, which does not pool file
+connections the same way.
+"""
+import os
+import time
+from sqlalchemy.pool import QueuePool
+from instrumentation import Histogram, metric_collectors
+from models import db
+
+pool_wait = Histogram("api_db_pool_wait_seconds", "Time spent waiting for a pooled connection.",
+                      (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+    pool_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe((("pool", self.pool_name),), time.perf_counter() - start)
+
+
+def instrumented_pool(name):
+    # a subclass per engine, SQLAlchemy instantiates (and recreates) the pool from the class
+    return type(f"{name.title()}QueuePool", (InstrumentedQueuePool,), {"pool_name": name})
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+def normalize_url(url):
+    # heroku and render still hand out postgres:// urls, SQLAlchemy only accepts postgresql://
+    return url.replace("postgres://", "postgresql://", 1) if url.startswith("postgres://") else url
+
+
+def engine_options(url, name):
+    """Engine options for `url` read from the DB_* environment variables"""
+    if url.startswith("sqlite"):
+        return {}
+    options = {
+        "poolclass": instrumented_pool(name),
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+    if statement_timeout > 0:
+        if url.startswith("postgresql"):
+            options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+        elif url.startswith("mysql"):
+            options["connect_args"] = {"init_command": f"SET SESSION max_execution_time={statement_timeout}"}
+    return options
+
+
+def pool_metrics():
+    pools = [(key or "primary", engine.pool) for key, engine in db.engines.items() if isinstance(engine.pool, QueuePool)]
+    lines = []
+    for metric, read in (("checked_out", QueuePool.checkedout), ("size", QueuePool.size), ("overflow", QueuePool.overflow)):
+        lines.append(f"# TYPE api_db_pool_{metric} gauge")
+        lines.extend(f'api_db_pool_{metric}{{pool="{name}"}} {read(pool)}' for name, pool in pools)
+    return lines + pool_wait.render()
+
+
+# once per process, create_app can run several times (benchmarks, scripts)
+metric_collectors.append(pool_metrics)
+
+
+def configure_database(app):
+    url = normalize_url(os.getenv("DATABASE_URL", "sqlite:////tmp/test.db"))
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url, "primary")
+    replica_url = os.getenv("DATABASE_REPLICA_URL")
+    if replica_url:
+        replica_url = normalize_url(replica_url)
+        app.config['SQLALCHEMY_BINDS'] = {"replica": {"url": replica_url, **engine_options(replica_url, "replica")}}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
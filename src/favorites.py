@@ -0,0 +1,101 @@
+"""
+Race free favorite writes.
+
+add_favorite is a single INSERT ... SELECT ... ON CONFLICT DO NOTHING: the SELECT
+only yields a row when the user and the planet/character/vehicle exist, and the
+partial unique index uq_favorite_user_<type> settles concurrent inserts, so two
+simultaneous taps create one row and neither of them fails. remove_favorite is a
+single DELETE that also removes duplicates left by older versions. Both update
+the counters of counters.py in the same transaction, since Core statements are
+not seen by its flush listener.
+"""
+from sqlalchemy import Integer, delete, exists, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from models import Favorite, User, FAVORITE_TYPES
+from counters import apply_favorite_deltas, user_counter
+from cache import changed_on_commit
+
+ADDED = "added"
+EXISTS = "exists"
+USER_NOT_FOUND = "user not found"
+NOT_FOUND = "not found"
+
+
+def _insert(dialect, table):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table)
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table)
+    if dialect == "mysql":
+        # MySQL has no partial indexes, its unique (user_id, <type>_id) index allows many NULLs
+        return insert(table).prefix_with("IGNORE")
+    return insert(table)
+
+
+def _bump_counters(session, user_id, type_name, ref_id, delta, pending=None):
+    deltas = {
+        (FAVORITE_TYPES[type_name].__tablename__, "favorite_count", ref_id): delta,
+        ("user", user_counter(type_name), user_id): delta,
+    }
+    if pending is not None:
+        pending.update(deltas)
+        return
+    apply_favorite_deltas(session.connection(), deltas)
+    changed_on_commit(session, "favorite")
+
+
+def apply_pending_counters(session, pending):
+    """Applies the counter changes collected with pending= by several writes, in one UPDATE per column"""
+    deltas = {key: delta for key, delta in pending.items() if delta}
+    if deltas:
+        apply_favorite_deltas(session.connection(), deltas)
+        changed_on_commit(session, "favorite")
+
+
+def add_favorite(session, user_id, type_name, ref_id, pending=None):
+    """
+    Adds the favorite if it is not there yet, returns ADDED, EXISTS, USER_NOT_FOUND
+    or NOT_FOUND. With a Counter as pending the counter changes are added to it
+    instead of being written, for apply_pending_counters.
+    """
+    model = FAVORITE_TYPES[type_name]
+    table = Favorite.__table__
+    column = table.c[f"{type_name}_id"]
+    source = select(literal(user_id, Integer), literal(ref_id, Integer)).where(
+        exists().where(User.id == user_id), exists().where(model.id == ref_id)
+    )
+    dialect = session.get_bind().dialect.name
+    stmt = _insert(dialect, table).from_select(["user_id", column.name], source)
+    if dialect in ("postgresql", "sqlite"):
+        stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.user_id, column], index_where=column.isnot(None))
+        inserted = session.execute(stmt).rowcount
+    else:
+        try:
+            with session.begin_nested():
+                inserted = session.execute(stmt).rowcount
+        except IntegrityError:
+            inserted = 0
+    if inserted:
+        _bump_counters(session, user_id, type_name, ref_id, 1, pending)
+        return ADDED
+
+    # nothing inserted, a second query only on this path to tell why
+    user_exists, ref_exists = session.execute(
+        select(exists().where(User.id == user_id), exists().where(model.id == ref_id))
+    ).one()
+    if not ref_exists:
+        return NOT_FOUND
+    return EXISTS if user_exists else USER_NOT_FOUND
+
+
+def remove_favorite(session, user_id, type_name, ref_id, pending=None):
+    """Deletes the favorite, returns how many rows were removed (pending as in add_favorite)"""
+    table = Favorite.__table__
+    removed = session.execute(
+        delete(table).where(table.c.user_id == user_id, table.c[f"{type_name}_id"] == ref_id)
+    ).rowcount
+    if removed:
+        _bump_counters(session, user_id, type_name, ref_id, -removed, pending)
+    return removed
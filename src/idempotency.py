@@ -0,0 +1,49 @@
+"""
+Idempotency-Key support for write routes.
+
+A client that retries a request with the same Idempotency-Key header gets the
+response of the first attempt replayed (with Idempotent-Replayed: true) instead
+of running the request again. Reusing a key for a different request is a 422.
+Responses are kept IDEMPOTENCY_TTL seconds (86400) by each worker; the favorite
+writes are idempotent by themselves, so a retry that reaches another worker
+still changes nothing twice. Server errors are not kept, they can be retried.
+"""
+import hashlib
+import os
+from functools import wraps
+from flask import request, make_response
+from cache import TTLCache
+from utils import APIException, ValidationError
+
+MAX_KEY_LENGTH = 255
+
+_responses = TTLCache(maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000)),
+                      ttl=float(os.getenv("IDEMPOTENCY_TTL", 86400)))
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(f"Idempotency-Key must have between 1 and {MAX_KEY_LENGTH} characters")
+        # keys are chosen by the clients, they only have to be unique per client
+        cache_key = (request.headers.get("Authorization") or request.remote_addr, key)
+        fingerprint = hashlib.sha1(f"{request.method} {request.full_path}".encode() + request.get_data()).digest()
+
+        stored = _responses.get(cache_key)
+        if stored is not None:
+            if stored[0] != fingerprint:
+                raise APIException("Idempotency-Key was already used for a different request", status_code=422)
+            response = make_response(stored[3], stored[1])
+            response.mimetype = stored[2]
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code < 500 and not response.is_streamed:
+            _responses.set(cache_key, (fingerprint, response.status_code, response.mimetype, response.get_data()))
+        return response
+    return wrapper
@@ -0,0 +1,164 @@
+"""
+Opt-in request instrumentation, enabled with API_INSTRUMENTATION=1.
+
+For every request it measures the wall time, the number of SQL statements and
+the time spent running them, reports them in a Server-Timing header and keeps
+per-endpoint histograms that are served at /metrics in Prometheus text format.
+Every gunicorn worker keeps its own numbers, so each scrape of /metrics shows
+the worker that answered it.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from flask import g, request, has_request_context, current_app, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from cache import entity_cache
+
+ENABLED = os.getenv("API_INSTRUMENTATION", "").lower() in ("1", "true", "yes")
+# requests running more statements than this are logged as probable N+1 queries
+QUERY_THRESHOLD = int(os.getenv("API_QUERY_THRESHOLD", 20))
+PROFILE_SAMPLE_RATE = float(os.getenv("API_PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("API_PROFILE_DIR", "/tmp/api-profiles")
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+                lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{self.name}{{{label_text}}} {value}")
+        return lines
+
+
+request_duration = Histogram("api_request_duration_seconds", "Wall time of each request.", DURATION_BUCKETS)
+sql_duration = Histogram("api_request_sql_seconds", "Time spent running SQL per request.", DURATION_BUCKETS)
+sql_queries = Histogram("api_request_sql_queries", "SQL statements run per request.", QUERY_BUCKETS)
+threshold_exceeded = Counter("api_query_threshold_exceeded_total", "Requests that ran more than API_QUERY_THRESHOLD statements.")
+
+# other modules (pool metrics, ...) append functions returning extra lines for /metrics
+metric_collectors = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_count" in g:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_count" in g and conn.info.get("query_start"):
+        g.sql_time += time.perf_counter() - conn.info["query_start"].pop()
+        g.sql_count += 1
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another thread is already being profiled
+            return
+        g.profiler = profiler
+
+
+def _finish_request(response):
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unknown"
+    labels = (("endpoint", endpoint), ("method", request.method))
+    request_duration.observe(labels + (("status", str(response.status_code)),), elapsed)
+    sql_duration.observe(labels, g.sql_time)
+    sql_queries.observe(labels, g.sql_count)
+
+    timing = f'app;dur={elapsed * 1000:.2f}, db;dur={g.sql_time * 1000:.2f};desc="{g.sql_count} queries"'
+    if g.sql_count > QUERY_THRESHOLD:
+        threshold_exceeded.inc(labels)
+        timing += ', nplusone;desc="query threshold exceeded"'
+        current_app.logger.warning("%s %s ran %d SQL statements (threshold %d)",
+                                   request.method, request.path, g.sql_count, QUERY_THRESHOLD)
+    response.headers["Server-Timing"] = timing
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{endpoint}-{time.time():.6f}.prof"))
+    return response
+
+
+def metrics():
+    lines = []
+    for metric in (request_duration, sql_duration, sql_queries, threshold_exceeded):
+        lines.extend(metric.render())
+    stats = entity_cache.stats()
+    lines += [
+        "# TYPE api_entity_cache_hits_total counter", f"api_entity_cache_hits_total {stats['hits']}",
+        "# TYPE api_entity_cache_misses_total counter", f"api_entity_cache_misses_total {stats['misses']}",
+        "# TYPE api_entity_cache_size gauge", f"api_entity_cache_size {stats['size']}",
+    ]
+    for collector in metric_collectors:
+        lines.extend(collector())
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def setup_instrumentation(app):
+    if not ENABLED:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics, methods=["GET"])
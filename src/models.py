@@ -1,12 +1,30 @@
+from flask import request, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, DDL
 
-db = SQLAlchemy()
+
+class RoutingSession(Session):
+    """Sends the reads of GET and HEAD requests to the replica bind when one is configured (see database.py)"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and "replica" in self._db.engines
+                and has_request_context() and request.method in ("GET", "HEAD")):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(200), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
+    # kept up to date by counters.py
+    favorite_planet_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    favorite_character_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    favorite_vehicle_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return '<User %r>' % self.id
@@ -27,6 +45,15 @@ class Planet(db.Model):
     climate = db.Column(db.String(120), nullable=False)
     gravity = db.Column(db.String(120), nullable=False)
     terrain = db.Column(db.String(120), nullable=False)
+    # users that have it in their favorites, kept up to date by counters.py
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # filters of the /planets list, keyset paginated by id
+    __table_args__ = (
+        db.Index('ix_planet_climate', 'climate', 'id'),
+        db.Index('ix_planet_terrain', 'terrain', 'id'),
+        db.Index('ix_planet_favorite_count', 'favorite_count', 'id'),
+    )
 
     def __repr__(self):
         return '<Planet %r>' % self.name
@@ -53,6 +80,12 @@ class Character(db.Model):
     eye_color = db.Column(db.String(50), nullable=True)
     birth_year = db.Column(db.String(10), nullable=True)
     gender = db.Column(db.String(20), nullable=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        db.Index('ix_character_gender', 'gender', 'id'),
+        db.Index('ix_character_favorite_count', 'favorite_count', 'id'),
+    )
 
     def __repr__(self):
         return '<Character %r>' % self.name
@@ -78,6 +111,13 @@ class Vehicle(db.Model):
     cost_in_credits = db.Column(db.Float, nullable=True)
     passengers = db.Column(db.Integer, nullable=True)
     cargo_capacity = db.Column(db.Integer, nullable=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        db.Index('ix_vehicle_manufacturer', 'manufacturer', 'id'),
+        db.Index('ix_vehicle_cost_in_credits', 'cost_in_credits', 'id'),
+        db.Index('ix_vehicle_favorite_count', 'favorite_count', 'id'),
+    )
 
     def __repr__(self):
         return '<Vehicle %r>' % self.name
@@ -104,6 +144,18 @@ class Favorite(db.Model):
     character = db.relationship('Character')
     vehicle = db.relationship('Vehicle')
 
+    # user_id alone serves the favorites list, the partial unique indexes serve
+    # the add/delete lookups and reject duplicated favorites in the database
+    __table_args__ = (
+        db.Index('ix_favorite_user_id', 'user_id'),
+        db.Index('uq_favorite_user_planet', 'user_id', 'planet_id', unique=True,
+                 postgresql_where=planet_id.isnot(None), sqlite_where=planet_id.isnot(None)),
+        db.Index('uq_favorite_user_character', 'user_id', 'character_id', unique=True,
+                 postgresql_where=character_id.isnot(None), sqlite_where=character_id.isnot(None)),
+        db.Index('uq_favorite_user_vehicle', 'user_id', 'vehicle_id', unique=True,
+                 postgresql_where=vehicle_id.isnot(None), sqlite_where=vehicle_id.isnot(None)),
+    )
+
     def __repr__(self):
         return '<Favorite %r>' % self.id
 
@@ -114,4 +166,57 @@ class Favorite(db.Model):
             "planet_id": self.planet_id,
             "character_id": self.character_id,
             "vehicle_id": self.vehicle_id
-        }
\ No newline at end of file
+        }
+
+    def serialize_expanded(self):
+        # expects planet, character and vehicle to be already loaded (see joinedload in app.py)
+        serialized = self.serialize()
+        serialized["planet"] = self.planet.serialize() if self.planet is not None else None
+        serialized["character"] = self.character.serialize() if self.character is not None else None
+        serialized["vehicle"] = self.vehicle.serialize() if self.vehicle is not None else None
+        return serialized
+
+
+class RevokedToken(db.Model):
+    """Tokens revoked before they expire (see auth.py), rows are useless once expires_at has passed"""
+    id = db.Column(db.Integer, primary_key=True)
+    # jti of one token, or NULL to revoke every token of the user issued up to revoked_at
+    jti = db.Column(db.String(32), unique=True, nullable=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    # unix timestamps, compared with the issue time signed in the tokens
+    revoked_at = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_revoked_token_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return '<RevokedToken %r>' % self.id
+
+
+# lower(name) indexes for the name_prefix search. They are not in __table_args__ because
+# alembic can not compare expression indexes and would add them again on every migrate,
+# existing databases get them from migration e7b2f19c4a60.
+for _model in (Planet, Character, Vehicle):
+    _table = _model.__tablename__
+    event.listen(_model.__table__, "after_create", DDL(
+        f'CREATE INDEX ix_{_table}_name_lower ON "{_table}" (lower(name) varchar_pattern_ops)'
+    ).execute_if(dialect="postgresql"))
+    event.listen(_model.__table__, "after_create", DDL(
+        f'CREATE INDEX ix_{_table}_name_lower ON "{_table}" (lower(name))'
+    ).execute_if(callable_=lambda ddl, target, bind, **kw: bind.dialect.name != "postgresql"))
+
+# catalog tables by the name used in the urls (/planets, /characters, /vehicles)
+CATALOG_MODELS = {
+    "planets": Planet,
+    "characters": Character,
+    "vehicles": Vehicle
+}
+
+# favorite types accepted by the favorites endpoints, the column is "<type>_id"
+FAVORITE_TYPES = {
+    "planet": Planet,
+    "character": Character,
+    "vehicle": Vehicle
+}
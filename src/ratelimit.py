@@ -0,0 +1,192 @@
+"""
+Token bucket rate limiting per client and per route.
+
+Every (route, client) pair has a bucket holding up to `burst` tokens that refills
+at the rate of its limit ("30/minute"); a request takes one token or gets a 429
+with Retry-After. Routes use DEFAULT_LIMIT unless decorated with @rate_limit.
+Every response of a limited route carries X-RateLimit-Limit, X-RateLimit-Remaining
+and X-RateLimit-Reset (seconds until the bucket is full again).
+
+    RATELIMIT_ENABLED      true/false (true)
+    RATELIMIT_BACKEND      "memory" (per worker) or a file path shared by the
+                           workers of one host, e.g. /tmp/ratelimit.db (memory)
+    RATELIMIT_DEFAULT      limit of the routes without their own (300/minute)
+    RATELIMIT_WRITE        user creation and favorite changes (30/minute)
+    RATELIMIT_EXPENSIVE    full lists, search and exports (20/minute)
+    RATELIMIT_TRUST_PROXY  identify clients by X-Forwarded-For, only behind a
+                           proxy that sets it (Render, Heroku) (false)
+    RATELIMIT_PROXY_HOPS   proxies in front of the app that append to
+                           X-Forwarded-For, the client is the address the
+                           outermost one appended (1)
+
+Requests with a valid bearer token (auth.py) are limited per user instead of per
+address, so users behind the same NAT do not share their buckets.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import g, request
+from instrumentation import Counter, metric_collectors
+from auth import authenticated_user_id
+from utils import TooManyRequestsError
+
+ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+DEFAULT_LIMIT = os.getenv("RATELIMIT_DEFAULT", "300/minute")
+WRITE_LIMIT = os.getenv("RATELIMIT_WRITE", "30/minute")
+EXPENSIVE_LIMIT = os.getenv("RATELIMIT_EXPENSIVE", "20/minute")
+TRUST_PROXY = os.getenv("RATELIMIT_TRUST_PROXY", "").lower() in ("1", "true", "yes")
+PROXY_HOPS = max(1, int(os.getenv("RATELIMIT_PROXY_HOPS", 1)))
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+rate_limited = Counter("api_rate_limited_total", "Requests rejected by the rate limiter.")
+metric_collectors.append(rate_limited.render)
+
+
+def parse_limit(limit, burst=None):
+    """"30/minute" -> (capacity, tokens per second)"""
+    count, _, period = limit.partition("/")
+    count = int(count)
+    return (burst or count), count / PERIODS[period.strip().rstrip("s") or "second"]
+
+
+class MemoryBackend:
+    """Buckets of the current process, each gunicorn worker limits on its own"""
+    # idle buckets are dropped once there are this many
+    max_buckets = 100000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """Takes a token, returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = [capacity, now]
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= 1
+            bucket[0] = tokens - 1 if allowed else tokens
+            bucket[1] = now
+            return allowed, bucket[0]
+
+    def _prune(self, now):
+        # the rate is not stored: buckets idle for an hour are dropped, which only makes daily limits more lenient
+        self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < 3600}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBackend:
+    """
+    Buckets in a SQLite file, shared by every worker that opens the same path.
+    Each check is a single upsert with RETURNING, atomic across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_bucket "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, stamp REAL NOT NULL, allowed INTEGER NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        # a connection opened before a fork (gunicorn preload_app) belongs to the parent
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # losing a few buckets on a power cut is fine, waiting for fsync on every request is not
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def consume(self, key, capacity, rate):
+        now = time.time()
+        refilled = "min(:capacity, tokens + (:now - stamp) * :rate)"
+        allowed, tokens = self._connection().execute(
+            "INSERT INTO rate_limit_bucket (key, tokens, stamp, allowed) VALUES (:key, :capacity - 1, :now, 1) "
+            f"ON CONFLICT (key) DO UPDATE SET allowed = {refilled} >= 1, "
+            f"tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END, stamp = :now "
+            "RETURNING allowed, tokens",
+            {"key": key, "capacity": capacity, "rate": rate, "now": now}
+        ).fetchone()
+        return bool(allowed), tokens
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit_bucket")
+
+
+def create_backend(name):
+    return MemoryBackend() if name == "memory" else SQLiteBackend(name)
+
+
+backend = create_backend(os.getenv("RATELIMIT_BACKEND", "memory"))
+_default = parse_limit(DEFAULT_LIMIT)
+
+
+def rate_limit(limit, burst=None):
+    """Route decorator replacing DEFAULT_LIMIT, e.g. @rate_limit(WRITE_LIMIT) or @rate_limit("5/second", burst=20)"""
+    parsed = parse_limit(limit, burst)
+
+    def decorator(fn):
+        fn.rate_limit = parsed
+        return fn
+    return decorator
+
+
+def client_key(req):
+    """Identifies the client of the request, the user of its bearer token when it has a valid one"""
+    if "Authorization" in req.headers:
+        user_id = authenticated_user_id()
+        if user_id is not None:
+            return f"user:{user_id}"
+    if TRUST_PROXY and req.access_route:
+        # the client writes the left of X-Forwarded-For itself, only the entries
+        # appended by our own proxies on the right can be trusted
+        route = req.access_route
+        return route[-min(PROXY_HOPS, len(route))]
+    return req.remote_addr or "unknown"
+
+
+def _check_limit(app):
+    # the proxies cost about a microsecond per access, resolve the request once
+    req = request._get_current_object()
+    endpoint = req.endpoint
+    if endpoint is None or req.method == "OPTIONS":
+        return None
+    capacity, rate = getattr(app.view_functions[endpoint], "rate_limit", _default)
+    allowed, tokens = backend.consume(f"{endpoint}:{client_key(req)}", capacity, rate)
+    g.rate_limit = (capacity, rate, tokens)
+    if allowed:
+        return None
+    rate_limited.inc((("endpoint", endpoint),))
+    raise TooManyRequestsError("Too many requests, slow down", retry_after=math.ceil((1 - tokens) / rate))
+
+
+def _add_headers(response):
+    state = g.get("rate_limit")
+    if state is not None:
+        capacity, rate, tokens = state
+        # add instead of set, nothing else writes these headers and set scans the existing ones
+        headers = response.headers
+        headers.add("X-RateLimit-Limit", str(capacity))
+        headers.add("X-RateLimit-Remaining", str(max(0, int(tokens))))
+        headers.add("X-RateLimit-Reset", str(math.ceil((capacity - tokens) / rate)))
+    return response
+
+
+def setup_rate_limit(app):
+    if not ENABLED:
+        return
+    app.before_request(lambda: _check_limit(app))
+    app.after_request(_add_headers)
@@ -0,0 +1,133 @@
+"""
+Full text search over planets, characters and vehicles.
+
+On PostgreSQL every catalog table has a GIN index on a weighted tsvector of its
+name and descriptive columns, kept up to date by the database itself. On SQLite
+the same documents live in the `catalog_search` FTS5 table, kept in sync by the
+mapper events below (bulk loads with Core must call rebuild_index afterwards).
+Both are created by migration f3a8d6e1c925 and, for create_all, by the
+metadata events at the end of this file.
+"""
+import re
+from sqlalchemy import event, text, DDL
+from models import db, Planet, Character, Vehicle
+
+# url name -> (model, descriptive columns searched after the name)
+SEARCHABLE = {
+    "planets": (Planet, ("climate", "terrain", "gravity")),
+    "characters": (Character, ("gender", "hair_color", "skin_color", "eye_color", "birth_year")),
+    "vehicles": (Vehicle, ("model", "manufacturer")),
+}
+# the FTS5 rowid is id * 4 + type code, so a row can be replaced without scanning
+TYPE_CODES = {"planets": 1, "characters": 2, "vehicles": 3}
+MAX_TERMS = 8
+
+FTS_TABLE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5("
+    "type UNINDEXED, ref_id UNINDEXED, name, body, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+
+def tsvector_sql(columns):
+    """Document expression of the PostgreSQL GIN indexes, queries must repeat it exactly"""
+    body = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+    return (f"setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            f"setweight(to_tsvector('simple', {body}), 'B')")
+
+
+def search_terms(q):
+    return re.findall(r"\w+", (q or "").lower())[:MAX_TERMS]
+
+
+def search(session, q, types, limit, offset):
+    """Returns [(type, id, name, rank)] best match first for the terms of `q`"""
+    terms = search_terms(q)
+    if session.get_bind().dialect.name == "postgresql":
+        selects = []
+        for type_name in types:
+            model, columns = SEARCHABLE[type_name]
+            document = tsvector_sql(columns)
+            selects.append(
+                f"SELECT '{type_name}' AS type, id, name, ts_rank({document}, query) AS rank "
+                f"FROM \"{model.__tablename__}\", to_tsquery('simple', :query) AS query WHERE {document} @@ query"
+            )
+        sql = " UNION ALL ".join(selects) + " ORDER BY rank DESC, type, id LIMIT :limit OFFSET :offset"
+        params = {"query": " & ".join(f"{t}:*" for t in terms), "limit": limit, "offset": offset}
+        return [(r.type, r.id, r.name, float(r.rank)) for r in session.execute(text(sql), params)]
+
+    type_list = ", ".join(f"'{t}'" for t in types)
+    # bm25 weights per column (type, ref_id, name, body): a match in the name counts 10 times more
+    sql = (
+        "SELECT type, ref_id, name, bm25(catalog_search, 0.0, 0.0, 10.0, 1.0) AS rank FROM catalog_search "
+        f"WHERE catalog_search MATCH :query AND type IN ({type_list}) ORDER BY rank, type, ref_id "
+        "LIMIT :limit OFFSET :offset"
+    )
+    params = {"query": " ".join(f'"{t}"*' for t in terms), "limit": limit, "offset": offset}
+    # bm25 is lower for better matches, it is negated so both databases rank higher = better
+    return [(r.type, r.ref_id, r.name, -r.rank) for r in session.execute(text(sql), params)]
+
+
+def _document(target, columns):
+    return " ".join(str(getattr(target, c)) for c in columns if getattr(target, c) is not None)
+
+
+def _make_listeners(type_name, columns):
+    code = TYPE_CODES[type_name]
+
+    def index_row(mapper, connection, target):
+        if connection.dialect.name != "sqlite":
+            return
+        connection.execute(
+            text("INSERT OR REPLACE INTO catalog_search (rowid, type, ref_id, name, body) "
+                 "VALUES (:rowid, :type, :ref_id, :name, :body)"),
+            {"rowid": target.id * 4 + code, "type": type_name, "ref_id": target.id,
+             "name": target.name, "body": _document(target, columns)}
+        )
+
+    def unindex_row(mapper, connection, target):
+        if connection.dialect.name != "sqlite":
+            return
+        connection.execute(text("DELETE FROM catalog_search WHERE rowid = :rowid"), {"rowid": target.id * 4 + code})
+
+    return index_row, unindex_row
+
+
+for _type_name, (_model, _columns) in SEARCHABLE.items():
+    _index_row, _unindex_row = _make_listeners(_type_name, _columns)
+    event.listen(_model, "after_insert", _index_row)
+    event.listen(_model, "after_update", _index_row)
+    event.listen(_model, "after_delete", _unindex_row)
+
+
+def rebuild_index(connection, type_name):
+    """Reindexes a whole table, for writes that skip the ORM (bulk imports). No-op on PostgreSQL."""
+    if connection.dialect.name != "sqlite":
+        return
+    model, columns = SEARCHABLE[type_name]
+    body = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+    connection.execute(text("DELETE FROM catalog_search WHERE type = :type"), {"type": type_name})
+    connection.execute(
+        text(f"INSERT INTO catalog_search (rowid, type, ref_id, name, body) "
+             f"SELECT id * 4 + {TYPE_CODES[type_name]}, :type, id, name, {body} FROM \"{model.__tablename__}\""),
+        {"type": type_name}
+    )
+
+
+def _create_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text(FTS_TABLE_DDL))
+    elif connection.dialect.name == "postgresql":
+        for type_name, (model, columns) in SEARCHABLE.items():
+            connection.execute(DDL(
+                f"CREATE INDEX IF NOT EXISTS ix_{model.__tablename__}_search "
+                f"ON \"{model.__tablename__}\" USING GIN (({tsvector_sql(columns)}))"
+            ))
+
+
+def _drop_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("DROP TABLE IF EXISTS catalog_search"))
+
+
+event.listen(db.metadata, "after_create", _create_index)
+event.listen(db.metadata, "before_drop", _drop_index)
@@ -0,0 +1,128 @@
+"""
+Fast serialization for read only responses.
+
+Instead of loading ORM objects and calling serialize() on each one, the
+handlers select plain column tuples and turn them into dicts with a function
+compiled once per (model, fields). The JSON is written with orjson when it is
+installed and with a prebuilt stdlib encoder otherwise. The output is byte for
+byte the same as jsonify(model.serialize()) outside debug mode (sorted keys,
+compact separators, ASCII only, trailing newline); when orjson would format a
+value differently (exponents, DEL, NaN and Infinity) or can not encode it (lone
+surrogates, integers beyond 64 bits) the stdlib encoder is used for that response.
+
+Clients that prefer MessagePack (Accept: application/msgpack) get the same data
+in that encoding from json_response when the msgpack package is installed.
+"""
+import json
+from flask import current_app, jsonify, request
+from sqlalchemy import select, bindparam
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# same options Flask uses for jsonify when the app is not in debug mode
+_encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True, ensure_ascii=True)
+# every digit as 0, so b"0e" finds the exponent of any number in orjson's output
+_DIGITS_AS_ZERO = bytes.maketrans(b"123456789", b"000000000")
+_serializers = {}
+_by_id_statements = {}
+
+
+def row_serializer(fields):
+    """Returns a function that turns a row (tuple) with `fields` in that order into a dict"""
+    fields = tuple(fields)
+    serializer = _serializers.get(fields)
+    if serializer is None:
+        # the field names come from serialize() keys, never from user input
+        source = "lambda row: {" + ", ".join(f"{name!r}: row[{i}]" for i, name in enumerate(fields)) + "}"
+        serializer = _serializers[fields] = eval(source)
+    return serializer
+
+
+def select_by_id(model, fields):
+    """SELECT of `fields` for one id (bound as :entity_id), built once per model and fields"""
+    key = (model, tuple(fields))
+    statement = _by_id_statements.get(key)
+    if statement is None:
+        statement = select(*[getattr(model, f) for f in fields]).where(model.id == bindparam("entity_id"))
+        _by_id_statements[key] = statement
+    return statement
+
+
+def _orjson_differs(data):
+    """
+    True when data holds a float orjson writes differently from json: NaN and
+    Infinity (null in orjson) and the ones json writes with an exponent, which
+    orjson formats its own way (1e-05 vs 1e-5, 1e-05 vs 0.00001 by version).
+    """
+    kind = type(data)
+    if kind is float:
+        return data - data != 0 or (data != 0 and not 1e-4 <= abs(data) < 1e16)
+    if kind is dict:
+        data = data.values()
+    elif kind is not list and kind is not tuple:
+        return False
+    for value in data:
+        kind = type(value)
+        if kind is float:
+            # x - x is nan for nan and the infinities
+            if value - value != 0 or (value != 0 and not 1e-4 <= abs(value) < 1e16):
+                return True
+        elif (kind is dict or kind is list or kind is tuple) and _orjson_differs(value):
+            return True
+    return False
+
+
+def _maybe_differs(body):
+    # byte checks that are much cheaper than walking the data, which only happens when one hits:
+    # an exponent, a long run of decimal zeros or a null that could be a NaN or an infinity
+    return b"null" in body or b"0.0000" in body or b"0e" in body.translate(_DIGITS_AS_ZERO)
+
+
+def dumps(data):
+    """Compact JSON as bytes, identical to what jsonify writes (without the trailing newline)"""
+    if orjson is not None:
+        try:
+            body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except orjson.JSONEncodeError:
+            body = None
+        # json escapes DEL as \u007f, orjson writes it as is
+        if (body is not None and body.isascii() and b"\x7f" not in body
+                and not (_maybe_differs(body) and _orjson_differs(data))):
+            return body
+    return _encoder.encode(data).encode("ascii")
+
+
+def wants_msgpack():
+    """True when the client ranks MessagePack above JSON in its Accept header"""
+    if msgpack is None:
+        return False
+    accept = request.accept_mimetypes
+    return max(accept.quality("application/msgpack"), accept.quality("application/x-msgpack")) > \
+        accept.quality("application/json")
+
+
+def json_response(data, status=200):
+    if wants_msgpack():
+        response = current_app.response_class(msgpack.packb(data), status=status, mimetype="application/msgpack")
+    else:
+        compact = current_app.json.compact
+        if compact is None:
+            compact = not current_app.debug
+        if compact:
+            response = current_app.response_class(dumps(data) + b"\n", status=status,
+                                                  mimetype=current_app.json.mimetype)
+        else:
+            # pretty printed output in debug mode, leave it to Flask
+            response = jsonify(data)
+            response.status_code = status
+    if msgpack is not None:
+        response.vary.add("Accept")
+    return response
@@ -1,4 +1,21 @@
-from flask import jsonify, url_for
+import base64
+import json
+import operator
+import re
+import uuid
+from flask import jsonify, url_for, request, g, current_app
+from sqlalchemy import select, func, and_, or_, tuple_, UniqueConstraint, PrimaryKeyConstraint
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from werkzeug.exceptions import HTTPException
+from serializers import row_serializer, dumps, json_response
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+_fields_cache = {}
+_indexed_cache = {}
+# query parameters of the list endpoints that are not filters
+LIST_PARAMETERS = ("limit", "after", "fields", "sort", "name_prefix", "ids")
+RANGE_OPERATORS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +32,319 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+class ValidationError(APIException):
+    status_code = 400
+
+class UnauthorizedError(APIException):
+    status_code = 401
+
+class ForbiddenError(APIException):
+    status_code = 403
+
+class NotFoundError(APIException):
+    status_code = 404
+
+class ConflictError(APIException):
+    status_code = 409
+
+class TooManyRequestsError(APIException):
+    status_code = 429
+
+    def __init__(self, message, retry_after, payload=None):
+        APIException.__init__(self, message, payload=payload)
+        self.retry_after = retry_after
+
+class ServiceUnavailableError(APIException):
+    status_code = 503
+
+# X-Request-ID values accepted from clients or proxies, anything else gets a new id
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+def _assign_request_id():
+    incoming = request.headers.get("X-Request-ID", "")
+    g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+def _send_request_id(response):
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+def _release_session():
+    # a failed flush or query leaves the transaction unusable until it is rolled back
+    from models import db
+    try:
+        db.session.rollback()
+    except SQLAlchemyError:
+        # the connection itself is broken, discard the session so the pool replaces it
+        db.session.remove()
+
+def error_response(error):
+    _release_session()
+    body = error.to_dict()
+    body["request_id"] = g.get("request_id")
+    response = jsonify(body)
+    response.status_code = error.status_code
+    if error.status_code == 503:
+        response.headers["Retry-After"] = "1"
+    elif error.status_code == 401:
+        response.headers["WWW-Authenticate"] = "Bearer"
+    elif error.status_code == 429:
+        response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+def _handle_http_exception(error):
+    # werkzeug errors (unknown url, wrong method, bad JSON body) as JSON, keeping their headers (Allow, ...)
+    _release_session()
+    response = error.get_response()
+    response.data = json.dumps({"message": error.description, "request_id": g.get("request_id")})
+    response.content_type = "application/json"
+    return response
+
+def _handle_database_error(error):
+    if isinstance(error, IntegrityError):
+        current_app.logger.info("request %s: integrity error %s", g.get("request_id"), error.orig)
+        return error_response(ConflictError("The request conflicts with data that already exists"))
+    if isinstance(error, (OperationalError, PoolTimeoutError)):
+        # lost connection, statement timeout or no free connection in the pool, worth retrying
+        current_app.logger.warning("request %s: database unavailable: %s", g.get("request_id"), error)
+        return error_response(ServiceUnavailableError("The database is not available, retry later"))
+    current_app.logger.exception("request %s: database error", g.get("request_id"))
+    return error_response(APIException("Database error", status_code=500))
+
+def _handle_unexpected_error(error):
+    current_app.logger.exception("request %s: unhandled error", g.get("request_id"))
+    return error_response(APIException("Internal server error", status_code=500))
+
+def setup_error_handlers(app):
+    """
+    JSON errors for the whole app. APIException and its subclasses carry their
+    own status; database errors map to 409 (integrity), 503 (connection, timeout)
+    or 500, anything else is a 500 without internal details. Every error rolls
+    back the session and answers with the request id, also sent as X-Request-ID
+    on every response and written in the logs.
+    """
+    app.before_request(_assign_request_id)
+    app.after_request(_send_request_id)
+    app.register_error_handler(APIException, error_response)
+    app.register_error_handler(HTTPException, _handle_http_exception)
+    app.register_error_handler(SQLAlchemyError, _handle_database_error)
+    app.register_error_handler(Exception, _handle_unexpected_error)
+
+def serialized_fields(model):
+    # the keys of serialize() are the public columns of the model, read them once
+    # from a blank instance so serialize() stays the only place that defines them
+    if model not in _fields_cache:
+        _fields_cache[model] = list(model().serialize().keys())
+    return _fields_cache[model]
+
+def indexed_fields(model):
+    """
+    Public columns that lead an index, a unique constraint or the primary key:
+    the only ones lists can filter and sort on, anything else would scan or
+    sort the whole table on every page.
+    """
+    if model not in _indexed_cache:
+        table = model.__table__
+        leading = {list(index.columns)[0].name for index in table.indexes if len(index.columns)}
+        leading.update(list(c.columns)[0].name for c in table.constraints
+                       if isinstance(c, (UniqueConstraint, PrimaryKeyConstraint)) and len(c.columns))
+        _indexed_cache[model] = [f for f in serialized_fields(model) if f in leading]
+    return _indexed_cache[model]
+
+def is_filtered():
+    """True when the list request narrows the rows with filters or name_prefix"""
+    return any(key not in LIST_PARAMETERS or key == "name_prefix" for key in request.args)
+
+def parse_fields(model):
+    fields = serialized_fields(model)
+    raw = request.args.get("fields")
+    if not raw:
+        return fields
+    requested = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in fields]
+    if unknown:
+        raise ValidationError(f"unknown fields: {', '.join(unknown)}", payload={"allowed": fields})
+    # id is always returned because it is the pagination cursor
+    return [f for f in fields if f == "id" or f in requested]
+
+def parse_ids(raw, name="ids"):
+    """"3,1,2" -> [3, 1, 2] in the same order, repeated ids only once"""
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw.split(",") if value.strip()))
+    except ValueError:
+        raise ValidationError(f"{name} must be a comma separated list of integers")
+    if not ids or len(ids) > MAX_PAGE_SIZE:
+        raise ValidationError(f"{name} must have between 1 and {MAX_PAGE_SIZE} ids")
+    return ids
+
+def parse_pagination():
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValidationError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit, request.args.get("after")
+
+def parse_sort(model):
+    """
+    sort=-cost,name -> [(column, descending)], id is always added as the last key
+    so the order is total. Only indexed columns, and nullable ones can not be
+    keyset paginated, so they can be filtered but not sorted on.
+    """
+    sortable = [f for f in indexed_fields(model) if not model.__table__.columns[f].nullable]
+    keys = []
+    for name in (request.args.get("sort") or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        descending = name.startswith("-")
+        name = name.lstrip("-")
+        if name not in sortable:
+            raise ValidationError(f"can not sort by {name}", payload={"sortable": sortable})
+        if name != "id":
+            keys.append((getattr(model, name), descending))
+        else:
+            return keys + [(model.id, descending)]
+    return keys + [(model.id, keys[-1][1] if keys else False)]
+
+def encode_cursor(values):
+    # plain id for the default order so the urls stay readable
+    if len(values) == 1:
+        return str(values[0])
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, keys):
+    try:
+        if len(keys) == 1:
+            values = [int(cursor)]
+        else:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [column.type.python_type(value) for value, (column, _) in zip(values, keys)]
+    except (ValueError, TypeError):
+        raise ValidationError("invalid after cursor, use the one from the next link")
+
+def keyset_condition(keys, values):
+    """Rows strictly after `values` in the order given by `keys`"""
+    if len({descending for _, descending in keys}) == 1:
+        # a row value comparison can use a composite index directly
+        row = tuple_(*[column for column, _ in keys])
+        return row < tuple_(*values) if keys[0][1] else row > tuple_(*values)
+    conditions = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        conditions.append(and_(*equal, column < values[i] if descending else column > values[i]))
+    return or_(*conditions)
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def parse_filters(session, model):
+    """
+    Equality filters (?climate=arid, repeat the parameter for several values),
+    ranges on numeric columns (?cost_in_credits__gte=1000) and a case
+    insensitive prefix search on the name (?name_prefix=lu), on indexed columns only.
+    """
+    filterable = [f for f in indexed_fields(model) if f != "id"]
+    conditions = []
+    for key in request.args:
+        if key in LIST_PARAMETERS:
+            continue
+        name, _, op = key.partition("__")
+        if name not in filterable or (op and op not in RANGE_OPERATORS):
+            raise ValidationError(f"unknown parameter {key}", payload={"filterable": filterable})
+        column = getattr(model, name)
+        python_type = column.type.python_type
+        try:
+            values = [python_type(value) for value in request.args.getlist(key)]
+        except ValueError:
+            raise ValidationError(f"{key} must be a {python_type.__name__}")
+        if not op:
+            conditions.append(column == values[0] if len(values) == 1 else column.in_(values))
+        elif python_type not in (int, float):
+            raise ValidationError(f"{name} does not support ranges")
+        else:
+            conditions.extend(RANGE_OPERATORS[op](column, value) for value in values)
+
+    prefix = request.args.get("name_prefix", "").lower()
+    if prefix:
+        lowered = func.lower(model.name)
+        conditions.append(lowered.like(escape_like(prefix) + "%", escape="\\"))
+        if session.get_bind().dialect.name == "sqlite":
+            # SQLite only uses the lower(name) index for ranges, not for LIKE
+            conditions.append(and_(lowered >= prefix, lowered < prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+    return conditions
+
+def keyset_page(session, model):
+    """
+    Returns one page of rows (as dicts) matching the filters and in the requested
+    order, selecting only the requested columns, plus the url of the next page
+    (None on the last one).
+    """
+    fields = parse_fields(model)
+    limit, after = parse_pagination()
+    keys = parse_sort(model)
+    conditions = parse_filters(session, model)
+    # the sort columns are selected after the fields, they are only used for the cursor
+    columns = [getattr(model, f) for f in fields] + [column for column, _ in keys]
+    statement = select(*columns).where(*conditions)
+    statement = statement.order_by(*[column.desc() if descending else column for column, descending in keys])
+    if after is not None:
+        statement = statement.where(keyset_condition(keys, decode_cursor(after, keys)))
+    # ask for one extra row to know if there is a next page without a COUNT(*)
+    rows = session.execute(statement.limit(limit + 1)).all()
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        args = request.args.to_dict(flat=False)
+        args["after"] = encode_cursor(list(rows[-1][len(fields):]))
+        next_url = url_for(request.endpoint, **args)
+    to_dict = row_serializer(fields)
+    return [to_dict(row) for row in rows], next_url
+
+def paginated_response(items, next_url):
+    response = json_response(items)
+    if next_url is not None:
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+def stream_rows(session, model, fields, fmt, batch_size=1000):
+    """
+    Generator with the whole table encoded as a JSON array or as NDJSON. Rows are
+    fetched with a server side cursor `batch_size` at a time, so memory does not
+    depend on the size of the table.
+    """
+    to_dict = row_serializer(fields)
+    query = session.query(*[getattr(model, f) for f in fields]).order_by(model.id).yield_per(batch_size)
+    separator = b"\n" if fmt == "ndjson" else b","
+    if fmt == "json":
+        yield b"["
+    chunk = []
+    first = True
+    for row in query:
+        chunk.append(dumps(to_dict(row)))
+        if len(chunk) == batch_size:
+            yield (b"" if first else separator) + separator.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b"" if first else separator) + separator.join(chunk)
+        first = False
+    if fmt == "json":
+        yield b"]"
+    elif not first:
+        yield b"\n"
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    # the admin is only there when ENABLE_ADMIN is set
+    links = ['/admin/'] if "admin" in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters